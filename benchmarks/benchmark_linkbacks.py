@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+'''
+Offline benchmark of the linkbacks plugin.
+
+A farm of local HTTP servers, one per loopback address (127.0.0.1, 127.0.0.2...), runs in a child process.
+They serve synthetic web pages of various sizes, with or without linkback endpoints,
+with a configurable latency & error rate, and implement both a pingback.ping XML-RPC endpoint & a Webmention receiver.
+Synthetic sets of articles of increasing sizes are then processed by process_all_articles_linkbacks,
+reporting links/sec, peak memory & wall time for a first build, then for an incremental build without any change.
+
+Usage: python benchmarks/benchmark_linkbacks.py --articles 100 1000 --links-per-article 5 --output bench_output.txt
+'''
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import xmlrpc.client
+
+from pelican.generators import ArticlesGenerator
+
+# Same import path as the tests, so that this script can be run from a git checkout:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pelican', 'plugins'))
+from linkbacks import LOGGER, process_all_articles_linkbacks  # pylint: disable=wrong-import-position
+
+
+PAGE_KINDS = ('pingback_header', 'pingback_link', 'webmention_header', 'webmention_link', 'both_links', 'none', 'none')
+
+
+class SyntheticPageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        params = self.server.params
+        page_id = int(self.path.rsplit('/', 1)[-1].split('.')[0])
+        rand = random.Random(page_id)  # every page is always generated the same way
+        time.sleep(params['latency'] * rand.uniform(0.5, 1.5))
+        if rand.random() < params['error_rate']:
+            self._reply(rand.choice((404, 410, 500, 503)), b'Error')
+            return
+        kind = rand.choice(PAGE_KINDS)
+        headers, head = {'Content-Type': 'text/html; charset=utf-8'}, ''
+        host = self.headers['Host']
+        if kind == 'pingback_header':
+            headers['X-Pingback'] = f'http://{host}/xmlrpc'
+        if kind == 'webmention_header':
+            headers['Link'] = f'<http://{host}/webmention>; rel="webmention"'
+        if kind in ('pingback_link', 'both_links'):
+            head += f'<link rel="pingback" href="http://{host}/xmlrpc">'
+        if kind in ('webmention_link', 'both_links'):
+            head += '<link rel="webmention" href="/webmention">'
+        body_size = int(rand.lognormvariate(10, 1.2))  # median ~22KB, with a few pages over 1MB
+        body = f'<!DOCTYPE html><html><head><title>Page {page_id}</title>{head}</head><body>'
+        body += '<p>Lorem ipsum dolor sit amet.</p>' * (body_size // 32) + '</body></html>'
+        self._reply(200, body.encode('utf8'), headers)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.params['latency'])
+        if self.path == '/xmlrpc':
+            (source_url, _), _ = xmlrpc.client.loads(body)
+            if random.Random(source_url).random() < 0.1:
+                response = xmlrpc.client.dumps(xmlrpc.client.Fault(48, 'The pingback has already been registered.'))
+            else:
+                response = xmlrpc.client.dumps(('Pingback registered',), methodresponse=True)
+            self._reply(200, response.encode('utf8'), {'Content-Type': 'text/xml'})
+        else:
+            self._reply(202, b'Accepted')
+
+    def _reply(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):  # pylint: disable=arguments-differ
+        pass
+
+class SyntheticServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, params):
+        super().__init__(server_address, SyntheticPageHandler)
+        self.params = params
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):  # the plugin closes connections once it has read enough
+            super().handle_error(request, client_address)
+
+def run_servers_farm(hosts_count, params, ready_queue, stop_event):
+    servers = []
+    for i in range(hosts_count):
+        server = SyntheticServer((f'127.0.0.{i + 1}', 0), params)
+        servers.append(server)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    ready_queue.put([f'{host}:{port}' for host, port in (server.server_address for server in servers)])
+    stop_event.wait()
+    for server in servers:
+        server.shutdown()
+
+class SyntheticArticle:
+    status = 'published'
+
+    def __init__(self, index, content):
+        self.slug = f'article-{index}'
+        self.url = f'{self.slug}.html'
+        self.content = content
+
+class SyntheticArticlesGenerator(ArticlesGenerator):
+    def __init__(self, settings, articles):  # pylint: disable=super-init-not-called
+        self.settings = settings
+        self.articles = articles
+
+def build_articles(articles_count, links_per_article, pages_count, hosts, seed=0):
+    rand = random.Random(seed)
+    articles = []
+    for index in range(articles_count):
+        links = ''.join(f'<p>See <a href="http://{rand.choice(hosts)}/pages/{rand.randrange(pages_count)}.html">this page</a></p>'
+                        for _ in range(links_per_article))
+        articles.append(SyntheticArticle(index, f'<h1>Article {index}</h1>{links}<a href="/internal.html">Internal</a>'))
+    return articles
+
+def run_benchmark(articles, settings, trace_memory):
+    generator = SyntheticArticlesGenerator(settings, articles)
+    if trace_memory:
+        tracemalloc.start()
+    start_time = time.perf_counter()
+    notifs_count = process_all_articles_linkbacks([generator])
+    wall_time = time.perf_counter() - start_time
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    with open(settings['LINKBACKS_METRICS_PATH'], encoding='utf8') as metrics_file:
+        metrics = json.load(metrics_file)
+    links_count = sum(metrics['counters'].get(counter, 0) for counter in ('links_cache_hits', 'links_cache_misses'))
+    return {
+        'wall_time': round(wall_time, 3),
+        'links': links_count,
+        'links_per_sec': round(links_count / wall_time, 1),
+        'notifications': notifs_count,
+        'peak_memory_mb': round(peak_memory / 2**20, 1) if peak_memory is not None else None,
+        'bytes_downloaded': metrics['counters'].get('bytes_downloaded', 0),
+        'phases': {name: round(phase['duration'], 3) for name, phase in metrics['phases'].items()},
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--articles', type=int, nargs='+', default=[100, 500], help='Sizes of the sets of articles to benchmark')
+    parser.add_argument('--links-per-article', type=int, default=5)
+    parser.add_argument('--pages', type=int, default=2000, help='Number of distinct synthetic pages per host')
+    parser.add_argument('--hosts', type=int, default=4, help='Number of local servers, bound to 127.0.0.1, 127.0.0.2...')
+    parser.add_argument('--latency', type=float, default=0.01, help='Average latency of the servers, in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    parser.add_argument('--settings', type=json.loads, default={}, help='Extra plugin settings, as a JSON object, e.g. {"LINKBACKS_MAX_WORKERS": 8}')
+    parser.add_argument('--no-trace-memory', action='store_false', dest='trace_memory', help='tracemalloc slows down execution')
+    parser.add_argument('--output', help='Also append the results, as JSON lines, to this file')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    LOGGER.setLevel(logging.ERROR)  # expected failures are logged as errors by the plugin
+
+    ready_queue, stop_event = multiprocessing.Queue(), multiprocessing.Event()
+    farm = multiprocessing.Process(target=run_servers_farm, daemon=True,
+                                   args=(args.hosts, {'latency': args.latency, 'error_rate': args.error_rate}, ready_queue, stop_event))
+    farm.start()
+    hosts = ready_queue.get(timeout=10)
+    try:
+        for articles_count in args.articles:
+            articles = build_articles(articles_count, args.links_per_article, args.pages, hosts)
+            with tempfile.TemporaryDirectory() as cache_dir:
+                settings = {'SITEURL': 'http://blog.example.com', 'CACHE_PATH': cache_dir,
+                            'LINKBACKS_METRICS_PATH': os.path.join(cache_dir, 'metrics.json'), **args.settings}
+                for build in ('first', 'incremental'):
+                    result = {'articles': articles_count, 'build': build, **run_benchmark(articles, settings, args.trace_memory)}
+                    print(json.dumps(result))
+                    if args.output:
+                        with open(args.output, 'a', encoding='utf8') as output_file:
+                            output_file.write(json.dumps(result) + '\n')
+    finally:
+        stop_event.set()
+        farm.join(timeout=5)
+
+if __name__ == '__main__':
+    main()
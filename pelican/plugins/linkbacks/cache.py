@@ -0,0 +1,309 @@
+from abc import ABC, abstractmethod
+from contextlib import closing
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+CACHE_FILENAME = 'pelican-plugin-linkbacks.json'
+SQLITE_CACHE_FILENAME = 'pelican-plugin-linkbacks.sqlite'
+DISCOVERY_CACHE_FILENAME = 'pelican-plugin-linkbacks-discovery.json'
+QUEUE_FILENAME = 'pelican-plugin-linkbacks-queue.json'
+DEFAULT_DISCOVERY_TTL = 7 * 24 * 3600  # in seconds
+
+LOGGER = logging.getLogger(__name__)
+
+
+class LinkbacksCache(ABC):
+    '''
+    Interface of the cache backends storing, per article slug, the links already processed
+    and a digest of the article content. Implementations must be thread-safe.
+    '''
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def has_link(self, slug, url):
+        pass
+
+    @abstractmethod
+    def add_link(self, slug, url):
+        pass
+
+    @abstractmethod
+    def get_digest(self, slug):
+        pass
+
+    @abstractmethod
+    def set_digest(self, slug, digest):
+        pass
+
+    @abstractmethod
+    def links_count(self):
+        pass
+
+    @abstractmethod
+    def iter_links(self):
+        'Yields (slug, url) for every link processed'
+
+class JsonCache(LinkbacksCache):
+    'Historical backend: the whole cache is loaded in memory, and only written back to a JSON file when closed'
+    def __init__(self, filepath):
+        super().__init__(filepath)
+        self._entries = {}
+        self._modified = False
+        self._lock = threading.Lock()
+
+    def open(self):
+        self._entries = load_json_cache(self.filepath)
+        for entry in self._entries.values():
+            entry['links'] = set(entry['links'])
+
+    def close(self):
+        with self._lock:
+            if not self._modified:
+                return
+            entries = {slug: dict(entry, links=list(entry['links'])) for slug, entry in self._entries.items()}
+        with open(self.filepath, 'w+', encoding='utf8') as cache_file:
+            json.dump(entries, cache_file)
+
+    def has_link(self, slug, url):
+        with self._lock:
+            return url in self._entries.get(slug, {}).get('links', ())
+
+    def add_link(self, slug, url):
+        with self._lock:
+            self._entries.setdefault(slug, {'links': set()})['links'].add(url)
+            self._modified = True
+
+    def get_digest(self, slug):
+        with self._lock:
+            return self._entries.get(slug, {}).get('digest')
+
+    def set_digest(self, slug, digest):
+        with self._lock:
+            self._entries.setdefault(slug, {'links': set()})['digest'] = digest
+            self._modified = True
+
+    def links_count(self):
+        with self._lock:
+            return sum(len(entry['links']) for entry in self._entries.values())
+
+    def iter_links(self):
+        with self._lock:
+            links = [(slug, url) for slug, entry in self._entries.items() for url in entry['links']]
+        yield from links
+
+class SqliteCache(LinkbacksCache):
+    '''
+    Indexed SQLite backend, where every link processed is committed immediately,
+    so that no progress is lost if the build is interrupted, and nothing has to be loaded in memory.
+    If the database does not exist yet, it is initialized from the JSON cache located in the same directory, if any.
+    '''
+    def __init__(self, filepath):
+        super().__init__(filepath)
+        self._db = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        json_cache_filepath = os.path.join(os.path.dirname(self.filepath), CACHE_FILENAME)
+        if not os.path.exists(self.filepath) and os.path.exists(json_cache_filepath):
+            self.import_json_cache(json_cache_filepath)
+        self._db = _connect_sqlite(self.filepath)
+
+    def import_json_cache(self, json_cache_filepath):
+        '''
+        The database is built in a temporary file, only moved in place once the migration is complete,
+        so that an interrupted or failed migration is attempted again on the next run
+        '''
+        entries = load_json_cache(json_cache_filepath)
+        tmp_filepath = self.filepath + '.tmp'
+        for filepath in (tmp_filepath, tmp_filepath + '-wal', tmp_filepath + '-shm'):  # leftovers of an interrupted migration
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        with closing(_connect_sqlite(tmp_filepath)) as tmp_db:
+            with tmp_db:
+                tmp_db.executemany('INSERT OR IGNORE INTO links (slug, url) VALUES (?, ?)',
+                                   ((slug, url) for slug, entry in entries.items() for url in entry['links']))
+                tmp_db.executemany('INSERT OR REPLACE INTO articles (slug, digest) VALUES (?, ?)',
+                                   ((slug, entry['digest']) for slug, entry in entries.items() if entry.get('digest')))
+        os.replace(tmp_filepath, self.filepath)
+        LOGGER.info("Linkbacks cache migrated from %s to %s", json_cache_filepath, self.filepath)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def has_link(self, slug, url):
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM links WHERE slug = ? AND url = ?', (slug, url)).fetchone() is not None
+
+    def add_link(self, slug, url):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR IGNORE INTO links (slug, url) VALUES (?, ?)', (slug, url))
+
+    def get_digest(self, slug):
+        with self._lock:
+            row = self._db.execute('SELECT digest FROM articles WHERE slug = ?', (slug,)).fetchone()
+        return row[0] if row else None
+
+    def set_digest(self, slug, digest):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO articles (slug, digest) VALUES (?, ?)', (slug, digest))
+
+    def links_count(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM links').fetchone()[0]
+
+    def iter_links(self):
+        with self._lock:
+            links = self._db.execute('SELECT slug, url FROM links').fetchall()
+        yield from links
+
+CACHE_BACKENDS = {'json': JsonCache, 'sqlite': SqliteCache}
+
+def _connect_sqlite(filepath):
+    connection = sqlite3.connect(filepath, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    with connection:
+        connection.execute('CREATE TABLE IF NOT EXISTS links (slug TEXT NOT NULL, url TEXT NOT NULL, PRIMARY KEY (slug, url)) WITHOUT ROWID')
+        connection.execute('CREATE TABLE IF NOT EXISTS articles (slug TEXT PRIMARY KEY, digest TEXT)')
+    return connection
+
+def load_json_cache(filepath):
+    try:
+        with open(filepath, encoding='utf8') as cache_file:
+            # Entries used to be plain lists of links, before content digests were introduced:
+            return {slug: entry if isinstance(entry, dict) else {'links': entry}
+                    for slug, entry in json.load(cache_file).items()}
+    except FileNotFoundError:
+        return {}
+
+def load_queue(filepath):
+    'Returns the articles queued by the plugin during the builds, as a dict: slug -> article plan'
+    try:
+        with open(filepath, encoding='utf8') as queue_file:
+            return json.load(queue_file)
+    except FileNotFoundError:
+        return {}
+
+def enqueue(filepath, article_plans):
+    queue = load_queue(filepath)
+    queue.update((article_plan['slug'], article_plan) for article_plan in article_plans)
+    save_queue(filepath, queue)
+
+def dequeue(filepath, article_plans):
+    'Removes from the queue those article plans, unless they have been queued again meanwhile with a different content'
+    queue = load_queue(filepath)
+    for article_plan in article_plans:
+        if queue.get(article_plan['slug'], {}).get('content_digest') == article_plan['content_digest']:
+            del queue[article_plan['slug']]
+    save_queue(filepath, queue)
+
+def save_queue(filepath, queue):
+    # Written atomically, as a build may be updating the queue while the pelican-linkbacks command processes it
+    tmp_filepath = filepath + '.tmp'
+    with open(tmp_filepath, 'w', encoding='utf8') as queue_file:
+        json.dump(queue, queue_file)
+    os.replace(tmp_filepath, filepath)
+
+class DiscoveryCache:
+    '''
+    Persistent cache of the linkback endpoints discovered (or not) for each target URL,
+    with their HTTP validators in order to revalidate stale entries with cheap conditional requests.
+    '''
+    def __init__(self, filepath, ttl=DEFAULT_DISCOVERY_TTL, by_origin=False):
+        self.filepath = filepath
+        self.ttl = ttl
+        self.by_origin = by_origin
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.filepath, encoding='utf8') as cache_file:
+                self._entries = json.load(cache_file)
+        except FileNotFoundError:
+            self._entries = {}
+
+    def save(self):
+        now = time.time()
+        with self._lock:
+            # Expired entries without validators would never be used again:
+            entries = {key: entry for key, entry in self._entries.items()
+                       if 'failure' in entry or now - entry['checked_at'] < self.ttl or entry.get('etag') or entry.get('last_modified')}
+        with open(self.filepath, 'w+', encoding='utf8') as cache_file:
+            json.dump(entries, cache_file)
+
+    def get(self, url):
+        'Returns the entry for this URL, and whether it is still fresh'
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry and 'failure' in entry:
+                entry = None
+            if self.by_origin and not (entry and now - entry['checked_at'] < self.ttl):
+                origin_entry = self._entries.get(_origin(url))
+                if origin_entry and now - origin_entry['checked_at'] < self.ttl:
+                    entry = origin_entry
+        if not entry:
+            return None, False
+        return entry, now - entry['checked_at'] < self.ttl
+
+    def put(self, url, endpoints, resp_headers=None):
+        entry = {'pingback': endpoints.pingback, 'webmention': endpoints.webmention, 'checked_at': time.time()}
+        if resp_headers:
+            entry['etag'] = resp_headers.get('ETag')
+            entry['last_modified'] = resp_headers.get('Last-Modified')
+        with self._lock:
+            self._entries[url] = entry
+            if self.by_origin:
+                self._entries[_origin(url)] = {key: entry[key] for key in ('pingback', 'webmention', 'checked_at')}
+
+    def refresh(self, url):
+        with self._lock:
+            self._entries[url]['checked_at'] = time.time()
+
+    def update(self, other, key_filter=None):
+        '''
+        Merges the entries of another discovery cache into this one, those of the other cache taking precedence.
+        If provided, key_filter is a predicate selecting the URLs / origins to merge.
+        '''
+        with other._lock:  # pylint: disable=protected-access
+            entries = {key: entry for key, entry in other._entries.items()  # pylint: disable=protected-access
+                       if key_filter is None or key_filter(key)}
+        with self._lock:
+            self._entries.update(entries)
+
+    def get_failure(self, url):
+        'Returns the record of the last failed attempts to retrieve this URL, if any'
+        with self._lock:
+            return self._entries.get(url, {}).get('failure')
+
+    def set_failure(self, url, failure):
+        with self._lock:
+            self._entries[url] = {'failure': failure}
+
+def _origin(url):
+    url_parts = urlsplit(url)
+    return f'{url_parts.scheme}://{url_parts.netloc}'
@@ -0,0 +1,57 @@
+'''
+pelican-linkbacks command: sends the linkbacks queued during Pelican builds performed with LINKBACKS_DEFERRED = True,
+so that network delays do not slow down publishing. It can be run later on, as a cron job or a deploy hook.
+
+The queue can also be split by target host into several shards, to be sent independently by different workers
+with "pelican-linkbacks send --cache-dir SHARD_DIR", before merging back their caches into the main one.
+'''
+import argparse
+import logging
+import os
+
+from pelican import DEFAULT_CONFIG_NAME
+from pelican.settings import read_settings
+
+from .cache import dequeue, load_queue
+from .linkbacks import LOGGER, ArticlePlan, LinkbackConfig, process_linkbacks
+from .sharding import merge_shards, shard_queue, shard_settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pelican-linkbacks', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', nargs='?', choices=('send', 'shard', 'merge'), default='send',
+                        help='send the queued linkbacks (default), split the queue into shards, or merge back the caches of shards')
+    parser.add_argument('-s', '--settings', help=f'Pelican settings file, defaults to {DEFAULT_CONFIG_NAME} if it exists')
+    parser.add_argument('-q', '--queue', help='Path to the queue file, overriding the LINKBACKS_QUEUEPATH setting')
+    parser.add_argument('-c', '--cache-dir', help='send: directory of a shard to process, shard & merge: directory containing the shards')
+    parser.add_argument('-n', '--shards', type=int, default=2, help='shard: number of shards to create')
+    parser.add_argument('-v', '--verbose', action='store_const', const=logging.INFO, dest='log_level', default=logging.WARNING)
+    parser.add_argument('-D', '--debug', action='store_const', const=logging.DEBUG, dest='log_level')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level, format='%(levelname)s: %(message)s')
+    if args.command in ('shard', 'merge') and not args.cache_dir:
+        parser.error(f'--cache-dir is required by the {args.command} command')
+
+    settings_path = args.settings
+    if settings_path is None and os.path.isfile(DEFAULT_CONFIG_NAME):
+        settings_path = DEFAULT_CONFIG_NAME
+    settings = read_settings(settings_path)
+    if args.command == 'send' and args.cache_dir:
+        settings = shard_settings(settings, args.cache_dir)
+    config = LinkbackConfig(settings)
+    queue_filepath = args.queue or config.queue_filepath
+    if args.command == 'shard':
+        shard_queue(config, queue_filepath, args.shards, args.cache_dir)
+        return 0
+    if args.command == 'merge':
+        merge_shards(settings, queue_filepath, args.cache_dir)
+        return 0
+    article_plans = [ArticlePlan.from_dict(values) for values in load_queue(queue_filepath).values()]
+    if not article_plans:
+        LOGGER.info("No article queued in %s", queue_filepath)
+        return 0
+    try:
+        process_linkbacks(config, article_plans=article_plans)
+    finally:  # Articles with links still to be retried are kept in the queue:
+        dequeue(queue_filepath, [article_plan.to_dict() for article_plan in article_plans if article_plan.completed])
+    return 0
@@ -0,0 +1,81 @@
+from collections import defaultdict
+import logging
+import threading
+from urllib.parse import urlsplit
+
+
+DEFAULT_CIRCUIT_BREAKER_THRESHOLD = 3
+ADAPTIVE_TIMEOUT_FACTOR = 4  # timeouts are this many times the slowest / fastest response time already observed for a host
+ADAPTIVE_TIMEOUT_MIN = 1  # in seconds
+
+LOGGER = logging.getLogger(__name__)
+
+
+class HostLimiter:
+    'Caps the number of links to the same host that are processed simultaneously'
+    def __init__(self, max_per_host):
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._semaphores = defaultdict(lambda: threading.BoundedSemaphore(self.max_per_host))
+
+    def slot(self, url):
+        host = urlsplit(url).hostname or ''
+        with self._lock:
+            return self._semaphores[host]
+
+class HostHealth:  # pylint: disable=too-many-instance-attributes
+    '''
+    Tracks the response times & failures of each host during a run, in order to derive adaptive timeouts,
+    and to stop contacting hosts after repeated timeouts or connection errors (circuit breaker).
+    '''
+    def __init__(self, timeout, adaptive_timeouts=False, failures_threshold=DEFAULT_CIRCUIT_BREAKER_THRESHOLD):
+        self.timeout = timeout
+        self.adaptive_timeouts = adaptive_timeouts
+        self.failures_threshold = failures_threshold  # 0 or None disables the circuit breaker
+        self.skipped_links = []
+        self._response_times = {}  # host -> (fastest, slowest)
+        self._consecutive_failures = defaultdict(int)
+        self._open_circuits = set()
+        self._lock = threading.Lock()
+
+    def timeouts(self, url):
+        'Returns the (connect, read) timeouts to use for a request to this URL'
+        if self.timeout is None:
+            return None
+        if not self.adaptive_timeouts:
+            return (self.timeout, self.timeout)
+        with self._lock:
+            response_times = self._response_times.get(_host(url))
+        if not response_times:
+            return (self.timeout, self.timeout)
+        return tuple(min(self.timeout, max(ADAPTIVE_TIMEOUT_MIN, ADAPTIVE_TIMEOUT_FACTOR * response_time)) for response_time in response_times)
+
+    def record_success(self, url, response_time=None):
+        host = _host(url)
+        with self._lock:
+            self._consecutive_failures.pop(host, None)
+            if response_time is not None:
+                fastest, slowest = self._response_times.get(host, (response_time, response_time))
+                self._response_times[host] = (min(fastest, response_time), max(slowest, response_time))
+
+    def record_failure(self, url):
+        'Returns True if this failure opened the circuit breaker of the URL host'
+        host = _host(url)
+        with self._lock:
+            self._consecutive_failures[host] += 1
+            if not self.failures_threshold or host in self._open_circuits or self._consecutive_failures[host] < self.failures_threshold:
+                return False
+            self._open_circuits.add(host)
+        LOGGER.warning("Host %s failed %s consecutive times: its remaining links will be skipped, and retried in a later run", host, self.failures_threshold)
+        return True
+
+    def is_open(self, url):
+        with self._lock:
+            return _host(url) in self._open_circuits
+
+    def skip(self, link_url):
+        with self._lock:
+            self.skipped_links.append(link_url)
+
+def _host(url):
+    return urlsplit(url).hostname or ''
@@ -1,34 +1,66 @@
-from contextlib import closing
+import codecs
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, closing, contextmanager
 try:
     from contextlib import nullcontext
 except ImportError:  # => Python 3.6
     from contextlib import suppress as nullcontext
 from datetime import datetime
+from itertools import chain
+import hashlib
 import json
+from html.parser import HTMLParser
 import logging
+import mimetypes
 import os
 from os import makedirs
 from os.path import splitext
+import re
 from ssl import CERT_NONE, SSLError
+import socket
+import threading
+import time
 import xmlrpc.client
 import warnings
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit, urlunsplit
 from urllib3.exceptions import InsecureRequestWarning, HTTPError
 
-from bs4 import BeautifulSoup
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 from requests.utils import parse_header_links
 
 from pelican import signals
 from pelican.generators import ArticlesGenerator
 
+from .hosts import DEFAULT_CIRCUIT_BREAKER_THRESHOLD, HostHealth, HostLimiter
+from .metrics import METRICS_FILENAME, RunMetrics
+from .cache import (
+    CACHE_BACKENDS, CACHE_FILENAME, DEFAULT_DISCOVERY_TTL, DISCOVERY_CACHE_FILENAME, QUEUE_FILENAME, SQLITE_CACHE_FILENAME,
+    DiscoveryCache, SqliteCache, enqueue,
+)
+
 
-BS4_HTML_PARSER = 'html.parser'  # Alt: 'html5lib', 'lxml', 'lxml-xml'
-CACHE_FILENAME = 'pelican-plugin-linkbacks.json'
 DEFAULT_USER_AGENT = 'pelican-plugin-linkbacks'
 DEFAULT_CERT_VERIFY = True
 DEFAULT_TIMEOUT = 3
+DEFAULT_MAX_WORKERS = 1
+DEFAULT_MAX_PER_HOST = 2
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CACHE_BACKEND = 'json'
+DEFAULT_EXCLUDED_EXTENSIONS = ('.gif', '.jpg', '.pdf', '.png', '.svg')
+DEFAULT_RETRY_DELAY = 24 * 3600  # in seconds, doubled after each failed attempt
+DEFAULT_RETRY_MAX_ATTEMPTS = 5
+PERMANENT_FAILURE_MAX_ATTEMPTS = 2  # e.g. a 404, checked once again later in case it was a temporary glitch
+PERMANENT_FAILURE_HTTP_STATUSES = (404, 410)
+# Unknown domain names, unlike temporary resolution failures like EAI_AGAIN:
+PERMANENT_FAILURE_GAI_ERRORS = tuple(getattr(socket, name) for name in ('EAI_NONAME', 'EAI_NODATA') if hasattr(socket, name))
+MULTICALL_MAX_SIZE = 50
+GET_CHUNK_SIZE = 2**14
+MAX_RESPONSE_LENGTH = 2**20
+HEAD_END_TAG = '</head'
+DEFAULT_PORTS = {'http': 80, 'https': 443}
 WEBMENTION_POSS_REL = ('webmention', 'http://webmention.org', 'http://webmention.org/', 'https://webmention.org', 'https://webmention.org/')
 
 LOGGER = logging.getLogger(__name__)
@@ -40,175 +72,843 @@ def process_all_articles_linkbacks(generators):
     if root_logger_level > 0:  # inherit root logger level, if defined
         LOGGER.setLevel(root_logger_level)
 
-    start_time = datetime.now()
     article_generator = next(g for g in generators if isinstance(g, ArticlesGenerator))
-
     config = LinkbackConfig(article_generator.settings)
+    published_articles = (article for article in article_generator.articles if article.status == 'published')
+    if config.deferred:
+        enqueue_linkbacks(published_articles, config)
+        return 0
+    if config.background:
+        start_background_linkbacks(config, list(published_articles))
+        return 0
+    return process_linkbacks(config, articles=published_articles)
 
-    try:
-        with open(config.cache_filepath, encoding='utf8') as cache_file:
-            cache = json.load(cache_file)
-    except FileNotFoundError:
-        cache = {}
+_BACKGROUND_RUNS = []
+_BACKGROUND_WARNINGS_FILTERS = ExitStack()
+
+def start_background_linkbacks(config, articles):
+    'Processes those articles in a thread, while Pelican writes the output, until join_background_linkbacks is called'
+    results = []
+    if not config.cert_verify:  # installed from the main thread, until join_background_linkbacks restores the previous filters
+        _BACKGROUND_WARNINGS_FILTERS.enter_context(warnings.catch_warnings())
+        warnings.simplefilter('ignore', InsecureRequestWarning)
+    def run():
+        try:
+            results.append(process_linkbacks(config, articles=articles, filter_warnings=False))
+        except Exception:
+            LOGGER.exception("Linkback plugin background execution failed")
+    # Not a daemon thread, so that the caches are always saved before the interpreter exits:
+    thread = threading.Thread(target=run, name='pelican-linkbacks')
+    thread.start()
+    _BACKGROUND_RUNS.append((thread, config, results))
+
+def join_background_linkbacks(*_):
+    '''
+    Waits for the linkbacks processed in background, up to LINKBACKS_BACKGROUND_DEADLINE seconds.
+    Once this deadline has expired, only the requests in progress are awaited, so that the caches are saved consistently.
+    Returns the number of notifications successfully sent.
+    '''
+    successful_notifs_count = 0
+    while _BACKGROUND_RUNS:
+        thread, config, results = _BACKGROUND_RUNS.pop(0)
+        thread.join(config.background_deadline)
+        if thread.is_alive():
+            LOGGER.warning("Linkback plugin still running after its deadline of %ss: remaining links will be processed during the next build",
+                           config.background_deadline)
+            config.stop_event.set()
+            thread.join()
+        successful_notifs_count += sum(results)
+    _BACKGROUND_WARNINGS_FILTERS.close()
+    return successful_notifs_count
+
+def process_linkbacks(config, articles=(), article_plans=(), filter_warnings=True):
+    '''
+    Sends linkbacks for those articles, and for those article plans (e.g. loaded from a queue file),
+    then saves the caches & log our progress, even in case of an interruption.
+    filter_warnings must be False outside of the main thread, as warnings.catch_warnings is not thread-safe.
+    Returns the number of notifications successfully sent.
+    '''
+    start_time = datetime.now()
+    cache = config.cache_backend(config.cache_filepath)
+    with config.metrics.phase('cache_load'):
+        cache.open()
+        config.discovery_cache.load()
 
-    original_cache_links_count = sum(len(urls) for slug, urls in cache.items())
+    original_cache_links_count = cache.links_count()
     successful_notifs_count = 0
     try:
-        for article in article_generator.articles:
-            if article.status == 'published':
-                with nullcontext() if config.cert_verify else warnings.catch_warnings():
-                    if not config.cert_verify:
-                        warnings.simplefilter('ignore', InsecureRequestWarning)
-                    successful_notifs_count += process_all_links_of_an_article(article, cache, config)
+        ignore_insecure_warnings = filter_warnings and not config.cert_verify
+        with warnings.catch_warnings() if ignore_insecure_warnings else nullcontext():
+            if ignore_insecure_warnings:
+                warnings.simplefilter('ignore', InsecureRequestWarning)
+            for notifs_count in run_linkbacks(chain(article_plans, plan_articles(articles, cache, config)), cache, config):
+                successful_notifs_count += notifs_count
         return successful_notifs_count
     finally:  # We save the cache & log our progress even in case of an interruption:
-        with open(config.cache_filepath, 'w+', encoding='utf8') as cache_file:
-            json.dump(cache, cache_file)
-        new_cache_links_count = sum(len(urls) for slug, urls in cache.items())
+        new_cache_links_count = cache.links_count()
+        with config.metrics.phase('cache_save'):
+            cache.close()
+            config.discovery_cache.save()
+        config.close()
         LOGGER.info("Linkback plugin execution took: %s - Links processed & inserted in cache: %s - Successful notifications: %s",
                     datetime.now() - start_time, new_cache_links_count - original_cache_links_count, successful_notifs_count)
+        if config.host_health.skipped_links:
+            LOGGER.warning("%s link(s) skipped because their host failed repeatedly, to be retried in a later run: %s",
+                           len(config.host_health.skipped_links), ', '.join(config.host_health.skipped_links))
+        config.metrics.incr('links_processed', new_cache_links_count - original_cache_links_count)
+        config.metrics.incr('successful_notifications', successful_notifs_count)
+        report_metrics(config)
 
-class LinkbackConfig:
+def report_metrics(config):
+    'Writes the metrics report of this execution as a JSON file, and passes it to the LINKBACKS_METRICS_HOOK callable, if any'
+    report = config.metrics.report()
+    if config.metrics_filepath:
+        with open(config.metrics_filepath, 'w+', encoding='utf8') as metrics_file:
+            json.dump(report, metrics_file, indent=2)
+    if config.metrics_hook:
+        try:
+            config.metrics_hook(report)
+        except Exception:  # a metrics sink failure must not break the build:
+            LOGGER.exception("LINKBACKS_METRICS_HOOK failed")
+
+def enqueue_linkbacks(articles, config):
+    'Only extracts links from articles that changed, and appends them to the queue file processed by the pelican-linkbacks command'
+    with config.cache_backend(config.cache_filepath) as cache:
+        article_plans = list(plan_articles(articles, cache, config))
+    enqueue(config.queue_filepath, [article_plan.to_dict() for article_plan in article_plans])
+    LOGGER.info("Linkback plugin queued %s articles in %s", len(article_plans), config.queue_filepath)
+
+class LinkbackConfig:  # pylint: disable=too-many-instance-attributes
     def __init__(self, settings=None):
         if settings is None:
             settings = {}
         self.siteurl = settings.get('SITEURL', '')
+        self.cache_backend = settings.get('LINKBACKS_CACHE_BACKEND', DEFAULT_CACHE_BACKEND)
+        if isinstance(self.cache_backend, str):
+            self.cache_backend = CACHE_BACKENDS[self.cache_backend]
         self.cache_filepath = settings.get('LINKBACKS_CACHEPATH')
         if not self.cache_filepath:
             cache_dir = settings.get('CACHE_PATH', '')
-            self.cache_filepath = os.path.join(cache_dir, CACHE_FILENAME)
+            self.cache_filepath = os.path.join(cache_dir, SQLITE_CACHE_FILENAME if self.cache_backend is SqliteCache else CACHE_FILENAME)
             if cache_dir:
                 makedirs(cache_dir, exist_ok=True)
+        self.link_filter = LinkFilter(self.siteurl,
+                                      excluded_domains=settings.get('LINKBACKS_EXCLUDED_DOMAINS', ()),
+                                      excluded_extensions=settings.get('LINKBACKS_EXCLUDED_EXTENSIONS', DEFAULT_EXCLUDED_EXTENSIONS),
+                                      excluded_mime_types=settings.get('LINKBACKS_EXCLUDED_MIME_TYPES', ()),
+                                      excluded_url_patterns=settings.get('LINKBACKS_EXCLUDED_URL_PATTERNS', ()))
         self.cert_verify = settings.get('LINKBACKS_CERT_VERIFY', DEFAULT_CERT_VERIFY)
         self.timeout = settings.get('LINKBACKS_REQUEST_TIMEOUT', DEFAULT_TIMEOUT)
         self.user_agent = settings.get('LINKBACKS_USERAGENT', DEFAULT_USER_AGENT)
+        self.max_workers = settings.get('LINKBACKS_MAX_WORKERS', DEFAULT_MAX_WORKERS)
+        self.max_per_host = settings.get('LINKBACKS_MAX_PER_HOST', DEFAULT_MAX_PER_HOST)
+        self.host_limiter = HostLimiter(self.max_per_host)
+        self.host_health = HostHealth(self.timeout,
+                                      adaptive_timeouts=settings.get('LINKBACKS_ADAPTIVE_TIMEOUTS', False),
+                                      failures_threshold=settings.get('LINKBACKS_CIRCUIT_BREAKER_THRESHOLD', DEFAULT_CIRCUIT_BREAKER_THRESHOLD))
+        self.pool_size = settings.get('LINKBACKS_POOL_SIZE', DEFAULT_POOL_SIZE)
+        self.pingback_batcher = PingbackBatcher() if settings.get('LINKBACKS_PINGBACK_MULTICALL', False) else None
+        self.max_response_bytes = settings.get('LINKBACKS_MAX_RESPONSE_BYTES', MAX_RESPONSE_LENGTH)
+        self.discovery_head_only = settings.get('LINKBACKS_DISCOVERY_HEAD_ONLY', False)
+        discovery_cache_filepath = settings.get('LINKBACKS_DISCOVERY_CACHEPATH') or \
+            os.path.join(os.path.dirname(self.cache_filepath), DISCOVERY_CACHE_FILENAME)
+        self.discovery_cache = DiscoveryCache(discovery_cache_filepath,
+                                              ttl=settings.get('LINKBACKS_DISCOVERY_TTL', DEFAULT_DISCOVERY_TTL),
+                                              by_origin=settings.get('LINKBACKS_DISCOVERY_CACHE_BY_ORIGIN', False))
+        self.retry_delay = settings.get('LINKBACKS_RETRY_DELAY', DEFAULT_RETRY_DELAY)
+        self.retry_max_attempts = settings.get('LINKBACKS_RETRY_MAX_ATTEMPTS', DEFAULT_RETRY_MAX_ATTEMPTS)
+        self.deferred = settings.get('LINKBACKS_DEFERRED', False)
+        self.background = settings.get('LINKBACKS_BACKGROUND', False)
+        self.background_deadline = settings.get('LINKBACKS_BACKGROUND_DEADLINE')
+        self.stop_event = threading.Event()
+        self.metrics = RunMetrics()
+        self.metrics_filepath = settings.get('LINKBACKS_METRICS_PATH', os.path.join(os.path.dirname(self.cache_filepath), METRICS_FILENAME))
+        self.metrics_hook = settings.get('LINKBACKS_METRICS_HOOK')
+        self.queue_filepath = settings.get('LINKBACKS_QUEUEPATH') or \
+            os.path.join(os.path.dirname(self.cache_filepath), QUEUE_FILENAME)
+        self._session = None
+        self._xmlrpc_transports = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        'Shared requests.Session, whose connections are kept alive & pooled per host'
+        with self._lock:
+            if self._session is None:
+                self._session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                self._session.mount('http://', adapter)
+                self._session.mount('https://', adapter)
+                self._session.headers['User-Agent'] = self.user_agent
+            return self._session
+
+    @contextmanager
+    def xmlrpc_transport(self, server_uri):
+        'Provides a XML-RPC transport, reusing its keep-alive connection for subsequent calls to the same endpoint host'
+        url_parts = urlsplit(server_uri)
+        key = (url_parts.scheme, url_parts.netloc)
+        with self._lock:
+            idle_transports = self._xmlrpc_transports[key]
+            transport = idle_transports.pop() if idle_transports else None
+        if transport is None:
+            transport = SafeXmlRpcTransport(self) if url_parts.scheme == 'https' else XmlRpcTransport(self)
+        try:
+            yield transport
+        except Exception:
+            transport.close()
+            raise
+        with self._lock:
+            if len(self._xmlrpc_transports[key]) < self.pool_size:
+                self._xmlrpc_transports[key].append(transport)
+                transport = None
+        if transport:
+            transport.close()
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+            for transports in self._xmlrpc_transports.values():
+                for transport in transports:
+                    transport.close()
+            self._xmlrpc_transports.clear()
+
+class PingbackBatcher:
+    '''
+    Groups the targets whose pingbacks remain to be sent per XML-RPC server, in order to send them in batches with system.multicall.
+    Those targets are only considered processed once their batch has been sent.
+    '''
+    def __init__(self):
+        self.unsupported_servers = set()
+        self._pending = defaultdict(list)
+        self._batched_targets = set()
+        self._lock = threading.Lock()
+
+    def add(self, server_uri, target_url, sources):
+        with self._lock:
+            self._pending[server_uri].append((target_url, sources))
+            self._batched_targets.add(target_url)
+
+    def is_batched(self, target_url):
+        with self._lock:
+            return target_url in self._batched_targets
+
+    def pop_batches(self):
+        'Returns all the pending targets, as a list of (server URI, list of (target URL, sources)), with at most MULTICALL_MAX_SIZE pingbacks per batch'
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(list)
+        batches = []
+        for server_uri, targets in pending.items():
+            batch, pings_count = [], 0
+            for target_url, sources in targets:
+                if batch and pings_count + len(sources) > MULTICALL_MAX_SIZE:
+                    batches.append((server_uri, batch))
+                    batch, pings_count = [], 0
+                batch.append((target_url, sources))
+                pings_count += len(sources)
+            batches.append((server_uri, batch))
+        return batches
 
 def process_all_links_of_an_article(article, cache, config):
-    source_url = os.path.join(config.siteurl, article.url)
-    successful_notifs_count = 0
-    links_cache = set(cache.get(article.slug, []))
-    # Even if an entry exists in the cache, we always extract all links,
-    # in order to support articles edits that could add new links.
-    doc_soup = BeautifulSoup(article.content, BS4_HTML_PARSER)
-    for anchor in doc_soup('a'):
-        if 'href' not in anchor.attrs:
+    return sum(run_linkbacks(plan_articles([article], cache, config), cache, config))
+
+def run_linkbacks(article_plans, cache, config):
+    '''
+    Groups the links of those articles by target URL, then processes every unique target in a pool of threads.
+    Yields the number of notifications successfully sent for each target, as soon as it has been processed.
+    '''
+    article_plans = list(article_plans)
+    targets = plan_targets(article_plans, cache, config)
+    for article_plan in article_plans:
+        if article_plan.completed:
+            cache.set_digest(article_plan.slug, article_plan.content_digest)
+    with ThreadPoolExecutor(max_workers=config.max_workers) as executor:
+        futures = {executor.submit(process_linkback_target, target_url, sources, cache, config): (target_url, sources)
+                   for target_url, sources in targets.items()}
+        batches_futures = {}
+        try:
+            for future in as_completed(futures):
+                notifs_count, processed = future.result()
+                target_url, sources = futures[future]
+                if not (config.pingback_batcher and config.pingback_batcher.is_batched(target_url)):
+                    for article_plan, _ in sources:
+                        article_plan.target_done(processed, cache)
+                yield notifs_count
+            if config.pingback_batcher:  # pingbacks are only sent once all targets have been processed:
+                batches_futures = {executor.submit(send_pingbacks_batch, server_uri, batch, config): batch
+                                   for server_uri, batch in config.pingback_batcher.pop_batches()}
+                for future in as_completed(batches_futures):
+                    notifs_count, processed = future.result()
+                    _pingbacks_batch_done(batches_futures[future], processed, cache)
+                    yield notifs_count
+        finally:  # On interruption, pending targets are abandoned but the ones in progress are awaited:
+            for future in chain(futures, batches_futures):
+                future.cancel()
+
+def _pingbacks_batch_done(batch, processed, cache):
+    'Targets of a batch of pingbacks are only considered processed once it has been sent'
+    for _, sources in batch:
+        if processed:
+            _add_links_to_cache(sources, cache)
+        for article_plan, _ in sources:
+            article_plan.target_done(processed, cache)
+
+class ArticlePlan:
+    '''
+    Links of an article that changed since it was last processed.
+    Tracks its targets remaining to be processed, in order to store its content digest once they all are.
+    '''
+    def __init__(self, slug, source_url, content_digest, links_urls):
+        self.slug = slug
+        self.source_url = source_url
+        self.content_digest = content_digest
+        self.links_urls = links_urls
+        self.planned = False  # until then, its targets are unknown
+        self.pending_targets = 0
+        self.all_links_processed = True
+
+    @property
+    def completed(self):
+        return self.planned and not self.pending_targets and self.all_links_processed
+
+    def target_done(self, processed, cache):
+        # Only called from the thread running the plan, hence no lock is required
+        self.pending_targets -= 1
+        self.all_links_processed = self.all_links_processed and processed
+        if self.completed:  # else the article will be parsed again next time, to retry the failed links
+            cache.set_digest(self.slug, self.content_digest)
+
+    def to_dict(self):
+        return {'slug': self.slug, 'source_url': self.source_url, 'content_digest': self.content_digest, 'links_urls': self.links_urls}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values['slug'], values['source_url'], values['content_digest'], values['links_urls'])
+
+def plan_articles(articles, cache, config):
+    'Extracts the links of all articles whose content changed since all their links were processed'
+    for article in articles:
+        content_digest = hashlib.sha256(article.content.encode('utf8')).hexdigest()
+        if cache.get_digest(article.slug) == content_digest:
+            LOGGER.debug("Article %s skipped because its content did not change since all its links were processed", article.slug)
+            config.metrics.incr('articles_unchanged')
             continue
-        link_url = anchor['href']
+        # If the article content changed since it was last processed, we extract all its links again,
+        # in order to support articles edits that could add new links.
+        with config.metrics.phase('link_extraction'):
+            links_urls = list(extract_links(article.content, config))
+        yield ArticlePlan(article.slug, os.path.join(config.siteurl, article.url), content_digest, links_urls)
+
+def plan_targets(article_plans, cache, config):
+    '''
+    Groups the links of all articles by normalized target URL, so that each target web page is only retrieved once.
+    Returns a dict: normalized target URL -> list of (ArticlePlan, links URLs found in this article)
+    '''
+    targets = defaultdict(list)
+    for article_plan in article_plans:
+        article_links = defaultdict(list)
+        for link_url in article_plan.links_urls:
+            if cache.has_link(article_plan.slug, link_url):
+                LOGGER.debug("Link url %s skipped because it has already been processed (present in cache)", link_url)
+                config.metrics.incr('links_cache_hits')
+                continue
+            config.metrics.incr('links_cache_misses')
+            article_links[normalize_url(link_url)].append(link_url)
+        for target_url, links_urls in article_links.items():
+            targets[target_url].append((article_plan, links_urls))
+            article_plan.pending_targets += 1
+        article_plan.planned = True
+    return targets
+
+def extract_links(html_content, config):
+    parser = AnchorsParser()
+    parser.feed(html_content)
+    parser.close()
+    for link_url in parser.links_urls:
+        if config.link_filter.accepts(link_url):
+            yield link_url
+
+class AnchorsParser(HTMLParser):
+    'Event-based HTML scanner collecting the href of all <a> tags, without building any document tree'
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links_urls = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'a':
+            return
+        href = next((value for name, value in attrs if name == 'href'), None)
+        if href:
+            self.links_urls.append(href)
+
+    handle_startendtag = handle_starttag
+
+    def error(self, message):  # only required by Python < 3.10
+        LOGGER.debug("HTML parsing error: %s", message)
+
+class LinkFilter:
+    '''
+    Rules excluding the links for which no linkback should be sent,
+    compiled once so that each link can be checked with a few set lookups & a single regex search.
+    '''
+    def __init__(self, siteurl='', excluded_domains=(), excluded_extensions=DEFAULT_EXCLUDED_EXTENSIONS,  # pylint: disable=too-many-arguments
+                 excluded_mime_types=(), excluded_url_patterns=()):
+        self.siteurl = siteurl
+        self.excluded_domains = frozenset(domain.lower() for domain in excluded_domains)
+        self.excluded_extensions = frozenset(ext.lower() for ext in excluded_extensions)
+        self.excluded_mime_types = tuple(excluded_mime_types)  # prefixes, e.g. 'video/'
+        self.excluded_url_regex = re.compile('|'.join(f'(?:{pattern})' for pattern in excluded_url_patterns)) if excluded_url_patterns else None
+
+    def accepts(self, link_url):  # pylint: disable=too-many-return-statements
         if not link_url.startswith('http'):  # this effectively exclude relative links
-            continue
-        if config.siteurl and link_url.startswith(config.siteurl):
-            LOGGER.debug("Link url %s skipped because is starts with %s", link_url, config.siteurl)
-            continue
-        if splitext(link_url)[1] in ('.gif', '.jpg', '.pdf', '.png', '.svg'):
+            return False
+        if self.siteurl and link_url.startswith(self.siteurl):
+            LOGGER.debug("Link url %s skipped because is starts with %s", link_url, self.siteurl)
+            return False
+        try:
+            url_parts = urlsplit(link_url)
+        except ValueError as error:  # e.g. an unbalanced bracket in the host
+            LOGGER.debug("Link url %s skipped because it is malformed: %s", link_url, error)
+            return False
+        if self.excluded_domains and self._is_excluded_host(url_parts.hostname or ''):
+            LOGGER.debug("Link url %s skipped because its domain is excluded", link_url)
+            return False
+        extension = splitext(url_parts.path)[1].lower()
+        if extension in self.excluded_extensions:
             LOGGER.debug("Link url %s skipped because it appears to be an image or PDF file", link_url)
-            continue
-        if link_url in links_cache:
-            LOGGER.debug("Link url %s skipped because it has already been processed (present in cache)", link_url)
-            continue
+            return False
+        if self.excluded_mime_types and extension:
+            mime_type = mimetypes.guess_type(url_parts.path)[0]
+            if mime_type and mime_type.startswith(self.excluded_mime_types):
+                LOGGER.debug("Link url %s skipped because it appears to be a %s file", link_url, mime_type)
+                return False
+        if self.excluded_url_regex and self.excluded_url_regex.search(link_url):
+            LOGGER.debug("Link url %s skipped because it matches an excluded pattern", link_url)
+            return False
+        return True
+
+    def _is_excluded_host(self, host):
+        'Subdomains of excluded domains are excluded too'
+        labels = host.split('.')
+        return any('.'.join(labels[i:]) in self.excluded_domains for i in range(len(labels)))
+
+def normalize_url(url):
+    '''
+    Provides a canonical form of URLs, in order to detect trivially different forms of the same URL:
+    lowercase scheme & host, no default port, no fragment, no trailing slash
+    '''
+    try:
+        url_parts = urlsplit(url)
+        port = url_parts.port
+    except ValueError:  # invalid port or IPv6 address
+        return url
+    scheme = url_parts.scheme.lower()
+    netloc = url_parts.hostname or ''
+    if ':' in netloc:  # IPv6 address
+        netloc = f'[{netloc}]'
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{netloc}:{port}'
+    if url_parts.username is not None:
+        userinfo = url_parts.username if url_parts.password is None else f'{url_parts.username}:{url_parts.password}'
+        netloc = f'{userinfo}@{netloc}'
+    path = url_parts.path.rstrip('/') or '/'
+    return urlunsplit((scheme, netloc, path, url_parts.query, ''))
+
+def process_linkback_target(target_url, sources, cache, config):  # pylint: disable=too-many-return-statements
+    '''
+    Retrieves a target web page once, then sends linkbacks to it for every article linking to it.
+    Returns the number of notifications successfully sent, and if this target has been fully processed.
+    '''
+    link_url = sources[0][1][0]  # the target web page is retrieved using the URL as it appears in the first article
+    if _deadline_expired(link_url, config):
+        return 0, False
+    failure = config.discovery_cache.get_failure(target_url)
+    if failure and failure['given_up']:
+        LOGGER.debug("Link url %s skipped because retrieving it failed too many times: [%s]", link_url, failure['error'])
+        _add_links_to_cache(sources, cache)
+        return 0, True
+    if failure and failure['next_attempt_at'] > time.time():
+        LOGGER.debug("Link url %s skipped until %s, after %s failed attempt(s): [%s]", link_url,
+                     datetime.fromtimestamp(failure['next_attempt_at']).isoformat(timespec='minutes'), failure['attempts'], failure['error'])
+        return 0, False
+    with config.host_limiter.slot(link_url):
+        if _deadline_expired(link_url, config):  # checked again, as waiting for this slot may have taken long
+            return 0, False
+        if config.host_health.is_open(link_url):
+            _skip_link_of_open_circuit(link_url, config)
+            return 0, False
         LOGGER.debug("Now attempting to send Linkbacks for link url %s", link_url)
         try:
-            resp_content, resp_headers = requests_get_with_max_size(link_url, config)
+            endpoints = fetch_endpoints(link_url, config)
         except Exception as error:
             LOGGER.debug("Failed to retrieve web page for link url %s: [%s] %s", link_url, error.__class__.__name__, error)
+            _record_error(link_url, error, config)
+            if record_fetch_failure(link_url, error, config)['given_up']:
+                _add_links_to_cache(sources, cache)
+                return 0, True
+            return 0, False
+        return notify_sources(target_url, sources, endpoints, cache, config)
+
+def notify_sources(target_url, sources, endpoints, cache, config):
+    'Sends linkbacks to a target for every article linking to it. Returns the number of notifications successfully sent, and if they all were attempted'
+    successful_notifs_count = 0
+    batched = config.pingback_batcher and endpoints.pingback
+    notified_sources = []
+    for article_plan, links_urls in sources:
+        if _deadline_expired(links_urls[0], config):  # the remaining sources will be notified in a later run
+            break
+        if any(endpoint and config.host_health.is_open(endpoint) for endpoint in endpoints):
+            _skip_link_of_open_circuit(links_urls[0], config, "the host of its linkback endpoint")
             continue
-        for notifier in (send_pingback, send_webmention):
-            if notifier(source_url, link_url, config, resp_content, resp_headers):
+        notifiers = (send_webmention,) if config.pingback_batcher else (send_pingback, send_webmention)
+        for notifier in notifiers:
+            if notifier(article_plan.source_url, links_urls[0], config, endpoints):
                 successful_notifs_count += 1
-        links_cache.add(link_url)
-    cache[article.slug] = list(links_cache)
-    return successful_notifs_count
+        notified_sources.append((article_plan, links_urls))
+        if not batched:
+            for url in links_urls:
+                cache.add_link(article_plan.slug, url)
+    if batched and notified_sources:  # their links will only be cached once their pingbacks have been sent
+        config.pingback_batcher.add(endpoints.pingback, target_url, notified_sources)
+    return successful_notifs_count, len(notified_sources) == len(sources)
+
+def _deadline_expired(link_url, config):
+    if config.stop_event.is_set():
+        LOGGER.debug("Link url %s skipped because the deadline of the plugin execution expired", link_url)
+        return True
+    return False
+
+def _skip_link_of_open_circuit(link_url, config, host_description='its host'):
+    # Neither cached nor recorded as a failure, so that it is retried in a later run
+    LOGGER.debug("Link url %s skipped because %s failed repeatedly during this run", link_url, host_description)
+    config.metrics.incr('links_skipped_circuit_open')
+    config.host_health.skip(link_url)
+
+def _record_error(url, error, config):
+    'Returns True if this error opened the circuit breaker of the URL host'
+    if isinstance(error, (requests.Timeout, socket.timeout)):
+        config.metrics.incr('timeouts')
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, socket.timeout, ConnectionError)):
+        return config.host_health.record_failure(url)
+    return False
+
+def _add_links_to_cache(sources, cache):
+    for article_plan, links_urls in sources:
+        for url in links_urls:
+            cache.add_link(article_plan.slug, url)
+
+def record_fetch_failure(target_url, error, config):
+    '''
+    Schedules the next attempt to retrieve this URL with an exponential backoff,
+    or gives up on it after too many failures, sooner if the failure seems permanent.
+    '''
+    cache_key = normalize_url(target_url)
+    failure = config.discovery_cache.get_failure(cache_key) or {'attempts': 0}
+    permanent = is_permanent_failure(error)
+    attempts = failure['attempts'] + 1
+    failure = {
+        'attempts': attempts,
+        'error': error.__class__.__name__,
+        'permanent': permanent,
+        'next_attempt_at': time.time() + config.retry_delay * 2**(attempts - 1),
+        'given_up': attempts >= (PERMANENT_FAILURE_MAX_ATTEMPTS if permanent else config.retry_max_attempts),
+    }
+    config.discovery_cache.set_failure(cache_key, failure)
+    if failure['given_up']:
+        LOGGER.warning("Giving up on link url %s after %s failed attempt(s): [%s] %s", target_url, attempts, error.__class__.__name__, error)
+    return failure
+
+def is_permanent_failure(error):
+    'HTTP 404 / 410 responses and unknown domain names are considered permanent'
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in PERMANENT_FAILURE_HTTP_STATUSES
+    visited, pending = set(), [error]
+    while pending:  # exploring the chain of exceptions, as requests & urllib3 wrap the underlying socket error:
+        error = pending.pop()
+        if error is None or id(error) in visited:
+            continue
+        visited.add(id(error))
+        if isinstance(error, socket.gaierror):
+            return error.errno in PERMANENT_FAILURE_GAI_ERRORS
+        pending.extend((error.__cause__, error.__context__, getattr(error, 'reason', None)))
+        pending.extend(arg for arg in error.args if isinstance(arg, BaseException))
+    return False
+
+LinkbackEndpoints = namedtuple('LinkbackEndpoints', ('pingback', 'webmention'))
+
+def fetch_endpoints(target_url, config=LinkbackConfig()):
+    'Retrieves the linkback endpoints of a web page, from the discovery cache if possible'
+    cache_key = normalize_url(target_url)
+    entry, fresh = config.discovery_cache.get(cache_key)
+    if entry and fresh:
+        LOGGER.debug("Linkback endpoints for link url %s retrieved from discovery cache", target_url)
+        config.metrics.incr('discovery_cache_hits')
+        return LinkbackEndpoints(entry['pingback'], entry['webmention'])
+    conditional_headers = {}
+    if entry and entry.get('etag'):
+        conditional_headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        conditional_headers['If-Modified-Since'] = entry['last_modified']
+    config.metrics.incr('discovery_cache_misses')
+    resp_content, resp_headers = requests_get_with_max_size(target_url, config, conditional_headers)
+    if resp_content is None:  # => 304 Not Modified
+        LOGGER.debug("Linkback endpoints for link url %s revalidated in discovery cache", target_url)
+        config.metrics.incr('discovery_cache_revalidations')
+        config.discovery_cache.refresh(cache_key)
+        return LinkbackEndpoints(entry['pingback'], entry['webmention'])
+    with config.metrics.phase('discovery_parse'):
+        endpoints = discover_endpoints(target_url, resp_content, resp_headers)
+    config.discovery_cache.put(cache_key, endpoints, resp_headers)
+    return endpoints
+
+def discover_endpoints(target_url, resp_content, resp_headers):
+    '''
+    Pingback & WebMention servers autodiscovery, looking first for HTTP headers,
+    and then parsing the HTML content only once, and only as far as needed, looking for <link> / <a> elements.
+    '''
+    pingback_uri = resp_headers.get('X-Pingback')
+    webmention_uri = _webmention_uri_from_headers(resp_headers)
+    if (not pingback_uri or webmention_uri is None) and resp_headers.get('Content-Type', '').startswith('text/html'):
+        parser = EndpointsDiscoveryParser(find_pingback=not pingback_uri, find_webmention=webmention_uri is None)
+        parser.scan(resp_content)
+        pingback_uri = pingback_uri or parser.pingback_uri
+        if webmention_uri is None:
+            webmention_uri = parser.webmention_uri
+    return LinkbackEndpoints(pingback=urljoin(target_url, pingback_uri) if pingback_uri else None,
+                             webmention=urljoin(target_url, webmention_uri) if webmention_uri is not None else None)
+
+def _webmention_uri_from_headers(resp_headers):
+    link_header = resp_headers.get('Link')
+    if not link_header:
+        return None
+    return next((lh.get('url') for lh in parse_header_links(link_header)
+                 if lh.get('url') and set(lh.get('rel', '').split()).intersection(WEBMENTION_POSS_REL)), None)
 
-def send_pingback(source_url, target_url, config=LinkbackConfig(), resp_content=None, resp_headers=None):
+class EndpointsDiscoveryParser(HTMLParser):
+    '''
+    Event-based HTML scanner, that does not build any document tree
+    and stops as soon as the linkback endpoints it looks for have been found.
+    '''
+    def __init__(self, find_pingback=True, find_webmention=True):
+        super().__init__(convert_charrefs=True)
+        self.find_pingback, self.find_webmention = find_pingback, find_webmention
+        self.pingback_uri, self.webmention_uri = None, None
+
+    def scan(self, html_content):
+        if not self.find_pingback and not self.find_webmention:
+            return
+        try:
+            self.feed(html_content)
+            self.close()
+        except _EndpointsFound:
+            pass
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ('a', 'link'):
+            return
+        attrs = dict(attrs)
+        href, rels = attrs.get('href'), set((attrs.get('rel') or '').lower().split())
+        if href is None or not rels:
+            return
+        if self.find_pingback and 'pingback' in rels and href:
+            self.pingback_uri, self.find_pingback = href, False
+        if self.find_webmention and rels.intersection(WEBMENTION_POSS_REL):
+            # An empty href is valid, and designates the target page itself:
+            self.webmention_uri, self.find_webmention = href, False
+        if not self.find_pingback and not self.find_webmention:
+            raise _EndpointsFound()
+
+    handle_startendtag = handle_starttag
+
+    def error(self, message):  # only required by Python < 3.10
+        LOGGER.debug("HTML parsing error: %s", message)
+
+class _EndpointsFound(Exception):
+    pass
+
+def send_pingback(source_url, target_url, config=LinkbackConfig(), endpoints=None):
+    server_uri = target_url
     try:
-        if resp_content is None:
-            resp_content, resp_headers = requests_get_with_max_size(target_url, config)
-        # Pingback server autodiscovery:
-        server_uri = resp_headers.get('X-Pingback')
-        if not server_uri and resp_headers.get('Content-Type', '').startswith('text/html'):
-            # As a falback, we try parsing the HTML, looking for <link> elements
-            doc_soup = BeautifulSoup(resp_content, BS4_HTML_PARSER)
-            link = doc_soup.find(rel='pingback', href=True)
-            if link:
-                server_uri = link['href']
+        if endpoints is None:
+            endpoints = discover_endpoints(target_url, *requests_get_with_max_size(target_url, config))
+        server_uri = endpoints.pingback
         if not server_uri:
             return False
         LOGGER.debug("Pingback URI detected: %s", server_uri)
         # Performing pingback request:
-        transport = SafeXmlRpcTransport(config) if server_uri.startswith('https') else XmlRpcTransport(config)
-        xml_rpc_client = xmlrpc.client.ServerProxy(server_uri, transport)
-        try:
-            response = xml_rpc_client.pingback.ping(source_url, target_url)
-        except xmlrpc.client.Fault as fault:
-            if fault.faultCode == 48:  # pingback already registered
-                LOGGER.debug("Pingback already registered for URL %s, XML-RPC response: code=%s - %s", target_url, fault.faultCode, fault.faultString)
-            else:
-                LOGGER.error("Pingback XML-RPC request failed for URL %s: code=%s - %s", target_url, fault.faultCode, fault.faultString)
-            return False
+        with config.metrics.phase('pingback'), config.xmlrpc_transport(server_uri) as transport:
+            xml_rpc_client = xmlrpc.client.ServerProxy(server_uri, transport)
+            try:
+                response = xml_rpc_client.pingback.ping(source_url, target_url)
+            except xmlrpc.client.Fault as fault:
+                _log_pingback_fault(target_url, fault)
+                return False
         LOGGER.info("Pingback notification sent for URL %s, endpoint response: %s", target_url, response)
+        config.host_health.record_success(server_uri)
         return True
     except (ConnectionError, HTTPError, RequestException, SSLError) as error:
         LOGGER.error("Failed to send Pingback for link url %s: [%s] %s", target_url, error.__class__.__name__, error)
+        _record_error(server_uri, error, config)
         return False
-    except Exception:  # unexpected exception => we display the stacktrace:
+    except Exception as error:  # unexpected exception => we display the stacktrace:
+        _record_error(server_uri, error, config)
         LOGGER.exception("Failed to send Pingback for link url %s", target_url)
         return False
 
-def send_webmention(source_url, target_url, config=LinkbackConfig(), resp_content=None, resp_headers=None):
+def _log_pingback_fault(target_url, fault):
+    if fault.faultCode == 48:  # pingback already registered
+        LOGGER.debug("Pingback already registered for URL %s, XML-RPC response: code=%s - %s", target_url, fault.faultCode, fault.faultString)
+    else:
+        LOGGER.error("Pingback XML-RPC request failed for URL %s: code=%s - %s", target_url, fault.faultCode, fault.faultString)
+
+def send_pingbacks_batch(server_uri, targets, config):  # pylint: disable=too-many-return-statements
+    '''
+    Sends the pingbacks of several targets to the same XML-RPC server in a single system.multicall request,
+    falling back to individual pingback.ping calls if the server does not support it.
+    Returns the number of pingbacks successfully sent, and if they have all been attempted.
+    '''
+    pings = [(article_plan.source_url, links_urls[0]) for _, sources in targets for article_plan, links_urls in sources]
+    if config.stop_event.is_set():
+        LOGGER.debug("Pingbacks to %s skipped because the deadline of the plugin execution expired", server_uri)
+        return 0, False
+    if config.host_health.is_open(server_uri):
+        for _, target_url in pings:
+            _skip_link_of_open_circuit(target_url, config, "the host of its Pingback endpoint")
+        return 0, False
+    if len(pings) == 1 or server_uri in config.pingback_batcher.unsupported_servers:
+        return _send_pingbacks_individually(server_uri, pings, config)
+    LOGGER.debug("Sending %s pingbacks to %s with system.multicall", len(pings), server_uri)
     try:
-        if resp_content is None:
-            resp_content, resp_headers = requests_get_with_max_size(target_url, config)
-        # WebMention server autodiscovery:
-        server_uri = None
-        link_header = resp_headers.get('Link')
-        if link_header:
-            try:
-                server_uri = next(lh.get('url') for lh in parse_header_links(link_header)
-                                  if lh.get('url') and lh.get('rel') in WEBMENTION_POSS_REL)
-            except StopIteration:
-                pass
-        if not server_uri and resp_headers.get('Content-Type', '').startswith('text/html'):
-            # As a falback, we try parsing the HTML, looking for <link> elements
-            doc_soup = BeautifulSoup(resp_content, BS4_HTML_PARSER)  # HTML parsing could be factord out of both methods
-            for link in doc_soup.find_all(rel=WEBMENTION_POSS_REL, href=True):
-                if link.get('href'):
-                    server_uri = link.get('href')
+        with config.host_limiter.slot(server_uri), config.metrics.phase('pingback'), config.xmlrpc_transport(server_uri) as transport:
+            multicall = xmlrpc.client.MultiCall(xmlrpc.client.ServerProxy(server_uri, transport))
+            for source_url, target_url in pings:
+                multicall.pingback.ping(source_url, target_url)
+            results = multicall()
+    except (xmlrpc.client.Fault, xmlrpc.client.ResponseError) as error:
+        LOGGER.debug("XML-RPC server %s does not support system.multicall, falling back to individual pingbacks: [%s] %s",
+                     server_uri, error.__class__.__name__, error)
+        config.pingback_batcher.unsupported_servers.add(server_uri)
+        return _send_pingbacks_individually(server_uri, pings, config)
+    except (ConnectionError, HTTPError, RequestException, SSLError, xmlrpc.client.ProtocolError) as error:  # e.g. an HTTP 503 response
+        for _, target_url in pings:
+            LOGGER.error("Failed to send Pingback for link url %s: [%s] %s", target_url, error.__class__.__name__, error)
+        _record_error(server_uri, error, config)
+        return 0, True
+    except Exception as error:  # unexpected exception => we display the stacktrace:
+        _record_error(server_uri, error, config)
+        LOGGER.exception("Failed to send Pingbacks to %s for link urls %s", server_uri, [target_url for _, target_url in pings])
+        return 0, True
+    config.metrics.incr('pingback_multicalls')
+    config.host_health.record_success(server_uri)
+    successful_pings_count = 0
+    for i, (_, target_url) in enumerate(pings):
+        try:
+            response = results[i]
+        except xmlrpc.client.Fault as fault:
+            _log_pingback_fault(target_url, fault)
+            continue
+        except (IndexError, ValueError) as error:
+            LOGGER.error("Failed to send Pingback for link url %s: [%s] %s", target_url, error.__class__.__name__, error)
+            continue
+        LOGGER.info("Pingback notification sent for URL %s, endpoint response: %s", target_url, response)
+        successful_pings_count += 1
+    return successful_pings_count, True
+
+def _send_pingbacks_individually(server_uri, pings, config):
+    endpoints = LinkbackEndpoints(server_uri, None)
+    successful_pings_count = 0
+    for i, (source_url, target_url) in enumerate(pings):
+        if config.stop_event.is_set():
+            LOGGER.debug("Pingbacks to %s skipped because the deadline of the plugin execution expired", server_uri)
+            return successful_pings_count, False
+        if config.host_health.is_open(server_uri):
+            for _, skipped_target_url in pings[i:]:
+                _skip_link_of_open_circuit(skipped_target_url, config, "the host of its Pingback endpoint")
+            return successful_pings_count, False
+        if send_pingback(source_url, target_url, config, endpoints):
+            successful_pings_count += 1
+    return successful_pings_count, True
+
+def send_webmention(source_url, target_url, config=LinkbackConfig(), endpoints=None):
+    server_uri = target_url
+    try:
+        if endpoints is None:
+            endpoints = discover_endpoints(target_url, *requests_get_with_max_size(target_url, config))
+        server_uri = endpoints.webmention
         if not server_uri:
             return False
         LOGGER.debug("WebMention URI detected: %s", server_uri)
-        server_uri = urljoin(target_url, server_uri)
         # Performing WebMention request:
-        response = requests.post(server_uri, headers={'User-Agent': config.user_agent}, timeout=config.timeout,
-                                 data={'source': source_url, 'target': target_url}, verify=config.cert_verify)
+        with config.metrics.phase('webmention'):
+            # verify is passed on each request, as REQUESTS_CA_BUNDLE would take precedence over a session-level verify=False:
+            response = config.session.post(server_uri, timeout=config.host_health.timeouts(server_uri), verify=config.cert_verify,
+                                           data={'source': source_url, 'target': target_url})
         response.raise_for_status()
         LOGGER.info("WebMention notification sent for URL %s, endpoint response: %s", target_url, response.text)
+        config.host_health.record_success(server_uri)
         return True
     except (ConnectionError, HTTPError, RequestException, SSLError) as error:
         LOGGER.error("Failed to send WebMention for link url %s: [%s] %s", target_url, error.__class__.__name__, error)
+        _record_error(server_uri, error, config)
         return False
-    except Exception:  # unexpected exception => we display the stacktrace:
+    except Exception as error:  # unexpected exception => we display the stacktrace:
+        _record_error(server_uri, error, config)
         LOGGER.exception("Failed to send WebMention for link url %s", target_url)
         return False
 
 
-GET_CHUNK_SIZE = 2**10
-MAX_RESPONSE_LENGTH = 2**20
-def requests_get_with_max_size(url, config=LinkbackConfig()):
+def requests_get_with_max_size(url, config=LinkbackConfig(), extra_headers=None):
     '''
     We cap the allowed response size, in order to make things faster and avoid downloading useless huge blobs of data
     cf. https://benbernardblog.com/the-case-of-the-mysterious-python-crash/
+    The body is not read at all if all linkback endpoints are provided as HTTP headers,
+    and with LINKBACKS_DISCOVERY_HEAD_ONLY it is only read until the end of its <head> section.
+    The content returned is None if the server replied 304 Not Modified to a conditional request.
     '''
-    with closing(requests.get(url, stream=True, timeout=config.timeout, verify=config.cert_verify,
-                              headers={'User-Agent': config.user_agent})) as response:
-        response.raise_for_status()
-        content = ''
-        for chunk in response.iter_content(chunk_size=GET_CHUNK_SIZE, decode_unicode=True):
-            content += chunk if response.encoding else chunk.decode()
-            if len(content) >= MAX_RESPONSE_LENGTH:
-                # Even truncated, the output is maybe still parsable as HTML to extract <link> tags.
-                # And if not, the linkback endpoint is maybe present as a HTTP header, so we do not abort and still return the content.
-                LOGGER.warning("The response for URL %s was too large, and hence was truncated to %s bytes.", url, MAX_RESPONSE_LENGTH)
-                break
-        return content, response.headers
+    start_time = time.perf_counter()
+    with config.metrics.phase('fetch'), closing(config.session.get(url, stream=True, timeout=config.host_health.timeouts(url),
+                                                                 verify=config.cert_verify, headers=extra_headers)) as response:
+        config.host_health.record_success(url, time.perf_counter() - start_time)
+        try:
+            return _read_response(url, response, config)
+        finally:
+            config.metrics.observe_latency(urlsplit(url).hostname or '', time.perf_counter() - start_time)
+
+def _read_response(url, response, config):
+    response.raise_for_status()
+    if response.status_code == 304:
+        return None, response.headers
+    if response.headers.get('X-Pingback') and _webmention_uri_from_headers(response.headers) is not None:
+        return '', response.headers
+    try:
+        decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    except LookupError:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    content_parts, bytes_read = [], 0
+    for chunk in response.iter_content(chunk_size=GET_CHUNK_SIZE):
+        chunk = chunk[:config.max_response_bytes - bytes_read]
+        bytes_read += len(chunk)
+        content_parts.append(decoder.decode(chunk))
+        if bytes_read >= config.max_response_bytes:
+            config.metrics.incr('truncations')
+            # Even truncated, the output is maybe still parsable as HTML to extract <link> tags.
+            # And if not, the linkback endpoint is maybe present as a HTTP header, so we do not abort and still return the content.
+            LOGGER.warning("The response for URL %s was too large, and hence was truncated to %s bytes.", url, config.max_response_bytes)
+            break
+        if config.discovery_head_only and _ends_head(content_parts):
+            LOGGER.debug("Stopped reading the response for URL %s at the end of its <head>, after %s bytes", url, bytes_read)
+            break
+    config.metrics.incr('bytes_downloaded', bytes_read)
+    content_parts.append(decoder.decode(b'', final=True))
+    return ''.join(content_parts), response.headers
+
+def _ends_head(content_parts):
+    'Looks for the closing </head> tag in the last chunk decoded, including the end of the previous one in case the tag overlaps both'
+    last_text = content_parts[-1]
+    if len(content_parts) > 1:
+        last_text = content_parts[-2][-len(HEAD_END_TAG):] + last_text
+    return HEAD_END_TAG in last_text.lower()
 
 class XmlRpcTransport(xmlrpc.client.Transport):
     def __init__(self, config):
@@ -221,7 +921,7 @@ class XmlRpcTransport(xmlrpc.client.Transport):
     def make_connection(self, host):
         conn = super().make_connection(host)
         if self.config.timeout is not None:
-            conn.timeout = self.config.timeout
+            conn.timeout = max(self.config.host_health.timeouts('//' + self.get_host_info(host)[0]))
         return conn
 
 class SafeXmlRpcTransport(xmlrpc.client.SafeTransport):
@@ -235,7 +935,7 @@ class SafeXmlRpcTransport(xmlrpc.client.SafeTransport):
     def make_connection(self, host):
         conn = super().make_connection(host)
         if self.config.timeout is not None:
-            conn.timeout = self.config.timeout
+            conn.timeout = max(self.config.host_health.timeouts('//' + self.get_host_info(host)[0]))
         if self.config.cert_verify is False:
             # pylint: disable=protected-access
             conn._check_hostname = False
@@ -245,3 +945,4 @@ class SafeXmlRpcTransport(xmlrpc.client.SafeTransport):
 
 def register():
     signals.all_generators_finalized.connect(process_all_articles_linkbacks)
+    signals.finalized.connect(join_background_linkbacks)
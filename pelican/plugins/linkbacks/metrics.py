@@ -0,0 +1,70 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+import threading
+import time
+
+
+METRICS_FILENAME = 'pelican-plugin-linkbacks-metrics.json'
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # in seconds
+
+
+class RunMetrics:
+    '''
+    Thread-safe collector of performance metrics over a plugin execution.
+    Phases durations are cumulated over all threads, hence their sum can exceed the total duration of the run.
+    '''
+    def __init__(self):
+        self.started_at = datetime.now()
+        self._start_time = time.perf_counter()
+        self._lock = threading.Lock()
+        self._phases = defaultdict(lambda: {'count': 0, 'duration': 0.0})
+        self._counters = Counter()
+        self._hosts = defaultdict(lambda: {'requests': 0, 'total_latency': 0.0, 'latency_histogram': [0] * (len(LATENCY_BUCKETS) + 1)})
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start_time
+            with self._lock:
+                self._phases[name]['count'] += 1
+                self._phases[name]['duration'] += duration
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def observe_latency(self, host, latency):
+        bucket = next((i for i, upper_bound in enumerate(LATENCY_BUCKETS) if latency <= upper_bound), len(LATENCY_BUCKETS))
+        with self._lock:
+            host_metrics = self._hosts[host]
+            host_metrics['requests'] += 1
+            host_metrics['total_latency'] += latency
+            host_metrics['latency_histogram'][bucket] += 1
+
+    def report(self):
+        'Returns all the metrics collected, as a JSON-serializable dict'
+        buckets_labels = [f'<={upper_bound}s' for upper_bound in LATENCY_BUCKETS] + [f'>{LATENCY_BUCKETS[-1]}s']
+        with self._lock:
+            counters = dict(self._counters)
+            return {
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'duration': time.perf_counter() - self._start_time,
+                'phases': {name: dict(phase) for name, phase in self._phases.items()},
+                'counters': counters,
+                'cache_hit_rates': {
+                    cache_name: counters.get(f'{cache_name}_hits', 0) / (counters.get(f'{cache_name}_hits', 0) + counters.get(f'{cache_name}_misses', 0))
+                    for cache_name in ('discovery_cache', 'links_cache')
+                    if counters.get(f'{cache_name}_hits', 0) + counters.get(f'{cache_name}_misses', 0)
+                },
+                'hosts': {
+                    host: {
+                        'requests': host_metrics['requests'],
+                        'total_latency': host_metrics['total_latency'],
+                        'latency_histogram': dict(zip(buckets_labels, host_metrics['latency_histogram'])),
+                    } for host, host_metrics in self._hosts.items()
+                },
+            }
@@ -0,0 +1,98 @@
+'''
+Sharded execution: the queued work plan is split by target host into several directories,
+each of them containing everything needed to be processed independently, on another worker or machine,
+before their caches get merged back into the main cache.
+'''
+import json
+import os
+from urllib.parse import urlsplit
+import zlib
+
+from .cache import DISCOVERY_CACHE_FILENAME, QUEUE_FILENAME, DiscoveryCache, load_queue, dequeue, save_queue
+from .linkbacks import LOGGER, LinkbackConfig, normalize_url
+
+
+SHARD_DIRNAME = 'shard-{}'
+SHARDS_MANIFEST_FILENAME = 'pelican-plugin-linkbacks-shards.json'
+# Settings of file paths that would otherwise point into the main cache directory:
+SHARD_OVERRIDEN_SETTINGS = ('LINKBACKS_CACHEPATH', 'LINKBACKS_DISCOVERY_CACHEPATH', 'LINKBACKS_QUEUEPATH', 'LINKBACKS_METRICS_PATH')
+
+
+def shard_index(link_url, shards_count):
+    'Stable across processes & machines, unlike hash(), so that all links to a given host end up in the same shard'
+    host = urlsplit(normalize_url(link_url)).hostname or ''
+    return zlib.crc32(host.encode('utf8')) % shards_count
+
+def shard_settings(settings, shard_dir):
+    'Returns the settings to use in order to process a shard, so that all the plugin files are stored in its directory'
+    settings = {key: value for key, value in settings.items() if key not in SHARD_OVERRIDEN_SETTINGS}
+    settings['CACHE_PATH'] = shard_dir
+    return settings
+
+def shard_queue(config, queue_filepath, shards_count, output_dir):
+    '''
+    Splits the links still to be processed for the articles queued into shards_count directories,
+    each one with its own queue & the discovery cache entries of its hosts. Returns the number of links in each shard.
+    '''
+    queue = load_queue(queue_filepath)
+    config.discovery_cache.load()
+    shards = [{} for _ in range(shards_count)]
+    with config.cache_backend(config.cache_filepath) as cache:
+        for slug, article_plan in queue.items():
+            for link_url in article_plan['links_urls']:
+                if cache.has_link(slug, link_url):
+                    continue
+                shard = shards[shard_index(link_url, shards_count)]
+                shard.setdefault(slug, dict(article_plan, links_urls=[]))['links_urls'].append(link_url)
+    for index, shard in enumerate(shards):
+        _save_shard(config, shard, index, shards_count, output_dir)
+    # Needed to tell, when merging, which articles have been fully processed:
+    with open(os.path.join(output_dir, SHARDS_MANIFEST_FILENAME), 'w', encoding='utf8') as manifest_file:
+        json.dump({'shards_count': shards_count, 'articles': {slug: article_plan['content_digest'] for slug, article_plan in queue.items()}}, manifest_file)
+    links_counts = [sum(len(article_plan['links_urls']) for article_plan in shard.values()) for shard in shards]
+    LOGGER.info("Linkback plugin split %s articles into %s shards of %s links in %s", len(queue), shards_count, links_counts, output_dir)
+    return links_counts
+
+def _save_shard(config, shard, index, shards_count, output_dir):
+    shard_dir = os.path.join(output_dir, SHARD_DIRNAME.format(index))
+    os.makedirs(shard_dir, exist_ok=True)
+    save_queue(os.path.join(shard_dir, QUEUE_FILENAME), shard)
+    # So that endpoints & past failures remain known. Each entry is only given to the shard of its host,
+    # so that the untouched entries of a shard cannot overwrite those refreshed by another one when merging:
+    shard_discovery_cache = DiscoveryCache(os.path.join(shard_dir, DISCOVERY_CACHE_FILENAME),
+                                           ttl=config.discovery_cache.ttl, by_origin=config.discovery_cache.by_origin)
+    shard_discovery_cache.update(config.discovery_cache, key_filter=lambda url: shard_index(url, shards_count) == index)
+    shard_discovery_cache.save()
+
+def merge_shards(settings, queue_filepath, output_dir):
+    '''
+    Merges the caches of all the shards created in output_dir into the main cache,
+    and removes from the main queue the articles whose links have all been processed by the shards.
+    Returns the number of those articles.
+    '''
+    config = LinkbackConfig(settings)
+    with open(os.path.join(output_dir, SHARDS_MANIFEST_FILENAME), encoding='utf8') as manifest_file:
+        manifest = json.load(manifest_file)
+    incomplete_slugs = set()
+    with config.cache_backend(config.cache_filepath) as cache:
+        config.discovery_cache.load()
+        for index in range(manifest['shards_count']):
+            shard_config = LinkbackConfig(shard_settings(settings, os.path.join(output_dir, SHARD_DIRNAME.format(index))))
+            if not os.path.exists(shard_config.queue_filepath):
+                raise FileNotFoundError(f'Missing shard queue: {shard_config.queue_filepath}')
+            with shard_config.cache_backend(shard_config.cache_filepath) as shard_cache:
+                for slug, link_url in shard_cache.iter_links():
+                    cache.add_link(slug, link_url)
+            shard_config.discovery_cache.load()
+            config.discovery_cache.update(shard_config.discovery_cache)
+            # Articles with links still to be retried are kept in the shard queue:
+            incomplete_slugs.update(load_queue(shard_config.queue_filepath))
+        completed_plans = [{'slug': slug, 'content_digest': content_digest}
+                           for slug, content_digest in manifest['articles'].items() if slug not in incomplete_slugs]
+        for article_plan in completed_plans:
+            cache.set_digest(article_plan['slug'], article_plan['content_digest'])
+        config.discovery_cache.save()
+    dequeue(queue_filepath, completed_plans)
+    LOGGER.info("Linkback plugin merged %s shards into %s: %s articles fully processed, %s still pending",
+                manifest['shards_count'], config.cache_filepath, len(completed_plans), len(incomplete_slugs))
+    return len(completed_plans)
@@ -1,14 +1,28 @@
-import logging, os
+from contextlib import contextmanager
+import json, logging, os, re, socket, threading, time, warnings, xmlrpc.client
 
 import httpretty
+import pytest
+import requests
+from urllib3.exceptions import InsecureRequestWarning
 from pelican.generators import ArticlesGenerator
 from pelican.tests.support import get_settings
 
-from linkbacks import process_all_articles_linkbacks, CACHE_FILENAME, LOGGER, MAX_RESPONSE_LENGTH
+from linkbacks.cache import JsonCache, LinkbacksCache, SqliteCache
+from linkbacks.cli import main as cli_main
+from linkbacks.sharding import shard_index
+from linkbacks import (
+    process_all_articles_linkbacks, CACHE_FILENAME, DISCOVERY_CACHE_FILENAME, METRICS_FILENAME, QUEUE_FILENAME, SQLITE_CACHE_FILENAME,
+    LOGGER, MAX_RESPONSE_LENGTH,
+    ArticlePlan, HostHealth, LinkbackConfig, LinkbackEndpoints, discover_endpoints, extract_links, join_background_linkbacks, normalize_url, requests_get_with_max_size,
+    is_permanent_failure, notify_sources, process_linkback_target, send_pingbacks_batch,
+)
 
 
 CUR_DIR = os.path.dirname(__file__)
 TEST_CONTENT_DIR = os.path.join(CUR_DIR, 'test_content')
+TEST_CONTENT_MULTI_DIR = os.path.join(CUR_DIR, 'test_content_multi')
+TEST_CONTENT_DEAD_HOST_DIR = os.path.join(CUR_DIR, 'test_content_dead_host')
 
 
 def setup():
@@ -22,6 +36,109 @@ def test_ok(tmpdir):
     article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir)
     assert process_all_articles_linkbacks([article_generator]) == 2
 
+@httpretty.activate
+def test_ok_concurrent(tmpdir):
+    _setup_http_mocks()
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir, LINKBACKS_MAX_WORKERS=4, LINKBACKS_MAX_PER_HOST=1)
+    assert process_all_articles_linkbacks([article_generator]) == 2
+    assert process_all_articles_linkbacks([article_generator]) == 0
+
+@httpretty.activate
+def test_same_target_in_several_articles(tmpdir):
+    _setup_http_mocks()
+    article_generator = _build_article_generator(TEST_CONTENT_MULTI_DIR, tmpdir)
+    assert process_all_articles_linkbacks([article_generator]) == 4
+    assert len([req for req in httpretty.latest_requests() if req.method == 'GET']) == 1
+    assert process_all_articles_linkbacks([article_generator]) == 0
+
+@httpretty.activate
+def test_pingback_multicall(tmpdir, caplog):
+    _setup_http_mocks()
+    xmlrpc_calls = []
+    httpretty.register_uri(httpretty.POST, 'http://localhost/sub/pingback-endpoint', body=_xmlrpc_multicall_callback(xmlrpc_calls, supported=True))
+    article_generator = _build_article_generator(TEST_CONTENT_MULTI_DIR, tmpdir, LINKBACKS_PINGBACK_MULTICALL=True)
+    assert process_all_articles_linkbacks([article_generator]) == 3
+    assert 'system.multicall' in xmlrpc_calls and 'pingback.ping' not in xmlrpc_calls
+    assert 'Pingback already registered for URL' in caplog.text
+
+@httpretty.activate
+def test_pingback_multicall_unsupported(tmpdir, caplog):
+    _setup_http_mocks()
+    xmlrpc_calls = []
+    httpretty.register_uri(httpretty.POST, 'http://localhost/sub/pingback-endpoint', body=_xmlrpc_multicall_callback(xmlrpc_calls, supported=False))
+    article_generator = _build_article_generator(TEST_CONTENT_MULTI_DIR, tmpdir, LINKBACKS_PINGBACK_MULTICALL=True)
+    assert process_all_articles_linkbacks([article_generator]) == 4
+    assert 'does not support system.multicall, falling back to individual pingbacks' in caplog.text
+
+@httpretty.activate
+def test_pingback_multicall_http_error(tmpdir, caplog):
+    _setup_http_mocks()
+    httpretty.register_uri(httpretty.POST, 'http://localhost/sub/pingback-endpoint', status=503)
+    article_generator = _build_article_generator(TEST_CONTENT_MULTI_DIR, tmpdir, LINKBACKS_PINGBACK_MULTICALL=True)
+    assert process_all_articles_linkbacks([article_generator]) == 2
+    # An unavailable server is not considered as not supporting system.multicall, and no individual pingbacks are attempted:
+    assert {xmlrpc.client.loads(req.body)[1] for req in httpretty.latest_requests() if req.path == '/sub/pingback-endpoint'} == {'system.multicall'}
+    assert 'does not support system.multicall' not in caplog.text
+    assert 'Failed to send Pingback for link url http://localhost/sub/some-page.html: [ProtocolError]' in caplog.text
+
+@httpretty.activate
+def test_cert_verify_disabled_despite_ca_bundle_env(tmpdir, monkeypatch):
+    monkeypatch.setenv('REQUESTS_CA_BUNDLE', '/nonexistent/ca-bundle.crt')
+    config = LinkbackConfig({'LINKBACKS_CERT_VERIFY': False, 'CACHE_PATH': str(tmpdir)})
+    sent_kwargs = []
+    original_send = config.session.send
+    def send(request, **kwargs):
+        sent_kwargs.append(kwargs)
+        return original_send(request, **kwargs)
+    monkeypatch.setattr(config.session, 'send', send)
+    httpretty.register_uri(httpretty.GET, 'https://localhost/some-page.html', body='<html></html>')
+    requests_get_with_max_size('https://localhost/some-page.html', config)
+    assert sent_kwargs[0]['verify'] is False
+
+@httpretty.activate
+def test_pingback_multicall_interrupted(tmpdir, monkeypatch):
+    _setup_http_mocks()
+    httpretty.register_uri(httpretty.POST, 'http://localhost/sub/pingback-endpoint', body=_xmlrpc_multicall_callback([], supported=True))
+    article_generator = _build_article_generator(TEST_CONTENT_MULTI_DIR, tmpdir, LINKBACKS_PINGBACK_MULTICALL=True)
+    def interrupted_batch(*_):
+        raise KeyboardInterrupt()
+    monkeypatch.setattr('linkbacks.linkbacks.send_pingbacks_batch', interrupted_batch)
+    with pytest.raises(KeyboardInterrupt):
+        process_all_articles_linkbacks([article_generator])
+    monkeypatch.undo()
+    # Links whose pingbacks have not been sent are neither cached, nor their articles digests:
+    assert process_all_articles_linkbacks([article_generator]) == 3
+
+def test_pingback_multicall_after_deadline():
+    config = LinkbackConfig({'LINKBACKS_PINGBACK_MULTICALL': True})
+    config.stop_event.set()
+    sources = [(ArticlePlan('article', 'http://localhost/blog/article.html', '42', ['http://localhost/sub/some-page.html']),
+                ['http://localhost/sub/some-page.html'])]
+    assert send_pingbacks_batch('http://localhost/sub/pingback-endpoint', [('http://localhost/sub/some-page.html', sources)] * 2, config) == (0, False)
+
+def test_normalize_url():
+    assert normalize_url('HTTP://Example.COM') == 'http://example.com/'
+    assert normalize_url('https://example.com:443/some/page/#section') == 'https://example.com/some/page'
+    assert normalize_url('http://example.com:8080/some/page?q=1') == 'http://example.com:8080/some/page?q=1'
+    assert normalize_url('http://[::1]:80/') == 'http://[::1]/'
+    assert normalize_url('http://[example.com/page') == 'http://[example.com/page'
+
+@httpretty.activate
+def test_metrics(tmpdir):
+    _setup_http_mocks(pingback=('link',), webmention=('link',))
+    reports = []
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir, LINKBACKS_METRICS_HOOK=reports.append)
+    assert process_all_articles_linkbacks([article_generator]) == 2
+    with open(os.path.join(article_generator.settings['CACHE_PATH'], METRICS_FILENAME), encoding='utf8') as metrics_file:
+        report = json.load(metrics_file)
+    assert reports == [report]
+    assert set(report['phases']) == {'cache_load', 'link_extraction', 'fetch', 'discovery_parse', 'pingback', 'webmention', 'cache_save'}
+    assert report['counters']['successful_notifications'] == 2
+    assert report['counters']['discovery_cache_misses'] == 1
+    assert report['counters']['bytes_downloaded'] > 0
+    assert report['cache_hit_rates'] == {'discovery_cache': 0, 'links_cache': 0}
+    assert report['hosts']['localhost']['requests'] == 1
+
 @httpretty.activate
 def test_ok_zero_linkbacks(tmpdir):
     _setup_http_mocks(pingback=(), webmention=())
@@ -34,13 +151,195 @@ def test_cache(tmpdir, caplog):
     article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir)
     assert process_all_articles_linkbacks([article_generator]) == 2
     assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Article dummy-article skipped because its content did not change since all its links were processed' in caplog.text
+
+@httpretty.activate
+def test_cache_article_edited(tmpdir, caplog):
+    _setup_http_mocks()
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir)
+    assert process_all_articles_linkbacks([article_generator]) == 2
+    cache_filepath = os.path.join(article_generator.settings['CACHE_PATH'], CACHE_FILENAME)
+    with open(cache_filepath, encoding='utf8') as cache_file:
+        cache = json.load(cache_file)
+    cache['dummy-article']['digest'] = 'previous-content-digest'
+    with open(cache_filepath, 'w', encoding='utf8') as cache_file:
+        json.dump(cache, cache_file)
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Link url http://localhost/sub/some-page.html skipped because it has already been processed (present in cache)' in caplog.text
+
+@httpretty.activate
+def test_cache_legacy_format(tmpdir, caplog):
+    _setup_http_mocks()
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir)
+    with open(os.path.join(article_generator.settings['CACHE_PATH'], CACHE_FILENAME), 'w', encoding='utf8') as cache_file:
+        json.dump({'dummy-article': ['http://localhost/sub/some-page.html']}, cache_file)
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Link url http://localhost/sub/some-page.html skipped because it has already been processed (present in cache)' in caplog.text
+
+@httpretty.activate
+def test_discovery_cache(tmpdir, caplog):
+    _setup_http_mocks()
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir)
+    assert process_all_articles_linkbacks([article_generator]) == 2
+    os.remove(os.path.join(article_generator.settings['CACHE_PATH'], CACHE_FILENAME))
+    assert process_all_articles_linkbacks([article_generator]) == 2
+    assert 'Linkback endpoints for link url http://localhost/sub/some-page.html retrieved from discovery cache' in caplog.text
+    assert len([req for req in httpretty.latest_requests() if req.method == 'GET']) == 1
+
+@httpretty.activate
+def test_discovery_cache_revalidation(tmpdir, caplog):
+    _setup_http_mocks()
+    httpretty.register_uri(httpretty.GET, 'http://localhost/sub/some-page.html', responses=[
+        httpretty.Response(body=_build_html_content(pingback=('link',), webmention=('link',)),
+                           adding_headers={'Content-Type': 'text/html', 'ETag': '"v1"'}),
+        httpretty.Response(body='', status=304),
+    ])
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir, LINKBACKS_DISCOVERY_TTL=0)
+    assert process_all_articles_linkbacks([article_generator]) == 2
+    os.remove(os.path.join(article_generator.settings['CACHE_PATH'], CACHE_FILENAME))
+    assert process_all_articles_linkbacks([article_generator]) == 2
+    assert 'Linkback endpoints for link url http://localhost/sub/some-page.html revalidated in discovery cache' in caplog.text
+    assert httpretty.last_request().method == 'POST'
+    assert [req.headers.get('If-None-Match') for req in httpretty.latest_requests() if req.method == 'GET'] == [None, '"v1"']
+
+def test_incomplete_cache_backend(tmpdir):
+    class IncompleteCache(LinkbacksCache):
+        def has_link(self, slug, url):
+            return False
+    config = LinkbackConfig({'LINKBACKS_CACHE_BACKEND': IncompleteCache, 'CACHE_PATH': str(tmpdir)})
+    with pytest.raises(TypeError):
+        config.cache_backend(config.cache_filepath)
+
+@httpretty.activate
+def test_sqlite_cache(tmpdir, caplog):
+    _setup_http_mocks()
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir, LINKBACKS_CACHE_BACKEND='sqlite')
+    assert process_all_articles_linkbacks([article_generator]) == 2
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Article dummy-article skipped because its content did not change since all its links were processed' in caplog.text
+    assert not os.path.exists(os.path.join(article_generator.settings['CACHE_PATH'], CACHE_FILENAME))
+
+@httpretty.activate
+def test_sqlite_cache_migration_from_json(tmpdir, caplog):
+    _setup_http_mocks()
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir, LINKBACKS_CACHE_BACKEND='sqlite')
+    with open(os.path.join(article_generator.settings['CACHE_PATH'], CACHE_FILENAME), 'w', encoding='utf8') as cache_file:
+        json.dump({'dummy-article': ['http://localhost/sub/some-page.html']}, cache_file)
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Linkbacks cache migrated from' in caplog.text
     assert 'Link url http://localhost/sub/some-page.html skipped because it has already been processed (present in cache)' in caplog.text
 
+def test_sqlite_cache_migration_failed(tmpdir):
+    sqlite_cache_filepath = str(tmpdir.join(SQLITE_CACHE_FILENAME))
+    json_cache_file = tmpdir.join(CACHE_FILENAME)
+    json_cache_file.write(json.dumps({'dummy-article': {'digest': '42'}}))  # invalid entry, without links
+    with pytest.raises(KeyError):
+        SqliteCache(sqlite_cache_filepath).open()
+    assert not os.path.exists(sqlite_cache_filepath)
+    json_cache_file.write(json.dumps({'dummy-article': {'digest': '42', 'links': ['http://localhost/sub/some-page.html']}}))
+    with SqliteCache(sqlite_cache_filepath) as cache:  # the migration is attempted again
+        assert cache.has_link('dummy-article', 'http://localhost/sub/some-page.html')
+        assert cache.get_digest('dummy-article') == '42'
+
+@httpretty.activate
+def test_deferred(tmpdir, caplog):
+    _setup_http_mocks()
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir, LINKBACKS_DEFERRED=True)
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert not httpretty.latest_requests()
+    queue_filepath = os.path.join(article_generator.settings['CACHE_PATH'], QUEUE_FILENAME)
+    with open(queue_filepath, encoding='utf8') as queue_file:
+        assert json.load(queue_file)['dummy-article']['links_urls'] == ['http://localhost/sub/some-page.html']
+    settings_filepath = tmpdir.join('pelicanconf.py')
+    settings_filepath.write(f'CACHE_PATH = {os.path.abspath(article_generator.settings["CACHE_PATH"])!r}')
+    assert cli_main(['--settings', str(settings_filepath)]) == 0
+    assert 'WebMention notification sent for URL http://localhost/sub/some-page.html' in caplog.text
+    with open(queue_filepath, encoding='utf8') as queue_file:
+        assert json.load(queue_file) == {}
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Article dummy-article skipped because its content did not change since all its links were processed' in caplog.text
+
+@httpretty.activate
+def test_deferred_failure_before_planning(tmpdir):
+    _setup_http_mocks()
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir, LINKBACKS_DEFERRED=True)
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    with open(os.path.join(article_generator.settings['CACHE_PATH'], CACHE_FILENAME), 'w', encoding='utf8') as cache_file:
+        cache_file.write('{corrupted')
+    settings_filepath = tmpdir.join('pelicanconf.py')
+    settings_filepath.write(f'CACHE_PATH = {os.path.abspath(article_generator.settings["CACHE_PATH"])!r}')
+    with pytest.raises(json.JSONDecodeError):
+        cli_main(['--settings', str(settings_filepath)])
+    assert not httpretty.latest_requests()
+    with open(os.path.join(article_generator.settings['CACHE_PATH'], QUEUE_FILENAME), encoding='utf8') as queue_file:
+        assert list(json.load(queue_file)) == ['dummy-article']
+
+@httpretty.activate
+def test_sharded(tmpdir, caplog):
+    _setup_http_mocks()
+    article_generator = _build_article_generator(TEST_CONTENT_MULTI_DIR, tmpdir, LINKBACKS_DEFERRED=True)
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    settings_filepath = tmpdir.join('pelicanconf.py')
+    settings_filepath.write(f'CACHE_PATH = {os.path.abspath(article_generator.settings["CACHE_PATH"])!r}')
+    shards_dir = str(tmpdir.join('shards'))
+    assert cli_main(['shard', '--settings', str(settings_filepath), '--cache-dir', shards_dir, '--shards', '3']) == 0
+    for index in range(3):
+        assert cli_main(['send', '--settings', str(settings_filepath), '--cache-dir', os.path.join(shards_dir, f'shard-{index}')]) == 0
+    assert len([req for req in httpretty.latest_requests() if req.method == 'GET']) == 1
+    assert cli_main(['merge', '--settings', str(settings_filepath), '--cache-dir', shards_dir]) == 0
+    with open(os.path.join(article_generator.settings['CACHE_PATH'], QUEUE_FILENAME), encoding='utf8') as queue_file:
+        assert json.load(queue_file) == {}
+    article_generator.settings['LINKBACKS_DEFERRED'] = False
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Article first-article skipped because its content did not change since all its links were processed' in caplog.text
+    assert 'Article second-article skipped because its content did not change since all its links were processed' in caplog.text
+
+def test_sharded_discovery_cache(tmpdir):
+    cache_dir, shards_dir = str(tmpdir.join('cache')), str(tmpdir.join('shards'))
+    os.makedirs(cache_dir)
+    settings_filepath = tmpdir.join('pelicanconf.py')
+    settings_filepath.write(f'CACHE_PATH = {cache_dir!r}')
+    links_urls = ['http://a.example/page', 'http://b.example/page']  # respectively in shards 0 & 1
+    with open(os.path.join(cache_dir, QUEUE_FILENAME), 'w', encoding='utf8') as queue_file:
+        json.dump({'article': {'slug': 'article', 'source_url': 'http://localhost/blog/article.html', 'content_digest': '42', 'links_urls': links_urls}}, queue_file)
+    failure = {'attempts': 1, 'error': 'ConnectionError', 'permanent': False, 'next_attempt_at': 0, 'given_up': False}
+    with open(os.path.join(cache_dir, DISCOVERY_CACHE_FILENAME), 'w', encoding='utf8') as discovery_cache_file:
+        json.dump({url: {'failure': failure} for url in links_urls}, discovery_cache_file)
+    assert cli_main(['shard', '--settings', str(settings_filepath), '--cache-dir', shards_dir, '--shards', '2']) == 0
+    for index, link_url in enumerate(links_urls):
+        with open(os.path.join(shards_dir, f'shard-{index}', DISCOVERY_CACHE_FILENAME), encoding='utf8') as discovery_cache_file:
+            assert list(json.load(discovery_cache_file)) == [link_url]
+    # Simulating shard 0 discovering the endpoints of a.example:
+    refreshed_entry = {'pingback': None, 'webmention': 'http://a.example/webmention', 'checked_at': time.time()}
+    with open(os.path.join(shards_dir, 'shard-0', DISCOVERY_CACHE_FILENAME), 'w', encoding='utf8') as discovery_cache_file:
+        json.dump({links_urls[0]: refreshed_entry}, discovery_cache_file)
+    assert cli_main(['merge', '--settings', str(settings_filepath), '--cache-dir', shards_dir]) == 0
+    with open(os.path.join(cache_dir, DISCOVERY_CACHE_FILENAME), encoding='utf8') as discovery_cache_file:
+        assert json.load(discovery_cache_file) == {links_urls[0]: refreshed_entry, links_urls[1]: {'failure': failure}}
+
+def test_shard_index():
+    assert shard_index('http://example.com/some/page', 4) == shard_index('HTTP://EXAMPLE.COM:80/other-page', 4)
+    assert {shard_index(f'http://host{i}.example.com/', 4) for i in range(20)} == {0, 1, 2, 3}
+
 def test_ignore_internal_links(tmpdir, caplog):
     article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir, site_url='http://localhost/sub/')
     assert process_all_articles_linkbacks([article_generator]) == 0
     assert 'Link url http://localhost/sub/some-page.html skipped because is starts with http://localhost/sub/' in caplog.text
 
+def test_extract_links(caplog):
+    html_content = '''<p><a href="http://example.com/page?a=1&amp;b=2">Page</a> <a name="anchor">Anchor</a> <a href="/relative">Relative</a>
+    <a href="https://example.com/photo.JPG">Photo</a> <a href="https://example.com/movie.mp4">Movie</a>
+    <a href="https://www.youtube.com/watch?v=42">Video</a> <a href="https://example.com/tags/python">Tag</a>
+    <a href="http://[example.com/typo">Typo</a></p>'''
+    config = LinkbackConfig({'LINKBACKS_EXCLUDED_DOMAINS': ['youtube.com'], 'LINKBACKS_EXCLUDED_MIME_TYPES': ['video/'],
+                             'LINKBACKS_EXCLUDED_URL_PATTERNS': [r'/tags/']})
+    assert list(extract_links(html_content, config)) == ['http://example.com/page?a=1&b=2']
+    assert 'Link url https://example.com/photo.JPG skipped because it appears to be an image or PDF file' in caplog.text
+    assert 'Link url https://example.com/movie.mp4 skipped because it appears to be a video/mp4 file' in caplog.text
+    assert 'Link url https://www.youtube.com/watch?v=42 skipped because its domain is excluded' in caplog.text
+    assert 'Link url https://example.com/tags/python skipped because it matches an excluded pattern' in caplog.text
+    assert 'Link url http://[example.com/typo skipped because it is malformed' in caplog.text
+
 def test_link_host_not_reachable(tmpdir, caplog):
     article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir)
     assert process_all_articles_linkbacks([article_generator]) == 0
@@ -48,6 +347,134 @@ def test_link_host_not_reachable(tmpdir, caplog):
     assert 'Failed to retrieve web page for link url http://localhost/sub/some-page.html' in caplog.text
     assert 'ConnectionError' in caplog.text
 
+def test_link_host_not_reachable_retry_later(tmpdir, caplog):
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir)
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Link url http://localhost/sub/some-page.html skipped until' in caplog.text
+    assert 'after 1 failed attempt(s): [ConnectionError]' in caplog.text
+
+def test_circuit_breaker(tmpdir, caplog):
+    article_generator = _build_article_generator(TEST_CONTENT_DEAD_HOST_DIR, tmpdir, LINKBACKS_CIRCUIT_BREAKER_THRESHOLD=2)
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Host localhost failed 2 consecutive times' in caplog.text
+    assert 'Link url http://localhost/sub/page-3.html skipped because its host failed repeatedly during this run' in caplog.text
+    assert '2 link(s) skipped because their host failed repeatedly, to be retried in a later run' in caplog.text
+    caplog.clear()
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Link url http://localhost/sub/page-1.html skipped until' in caplog.text
+    assert 'Failed to retrieve web page for link url http://localhost/sub/page-3.html' in caplog.text
+
+@httpretty.activate
+def test_background(tmpdir):
+    _setup_http_mocks()
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir, LINKBACKS_BACKGROUND=True)
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert join_background_linkbacks() == 2
+
+@httpretty.activate
+def test_background_deadline(tmpdir, caplog):
+    def slow_page(_, __, response_headers):
+        time.sleep(0.5)
+        return 200, response_headers, '<html><head></head><body></body></html>'
+    httpretty.register_uri(httpretty.GET, re.compile(r'http://localhost/sub/page-\d.html'), body=slow_page)
+    article_generator = _build_article_generator(TEST_CONTENT_DEAD_HOST_DIR, tmpdir, LINKBACKS_BACKGROUND=True, LINKBACKS_BACKGROUND_DEADLINE=0.1)
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert join_background_linkbacks() == 0
+    assert 'Linkback plugin still running after its deadline of 0.1s' in caplog.text
+    assert 'Link url http://localhost/sub/page-4.html skipped because the deadline of the plugin execution expired' in caplog.text
+    # The page retrieved when the deadline expired is not notified, hence neither cached:
+    assert 'Link url http://localhost/sub/page-1.html skipped because the deadline of the plugin execution expired' in caplog.text
+    assert not os.path.exists(os.path.join(article_generator.settings['CACHE_PATH'], CACHE_FILENAME))
+
+@httpretty.activate
+def test_circuit_breaker_on_endpoint_host(tmpdir, caplog):
+    headers = {'Content-Type': 'text/html', 'Link': '<http://127.0.0.1:1/webmention>; rel="webmention"'}  # nothing listens on port 1
+    httpretty.register_uri(httpretty.GET, re.compile(r'http://localhost/sub/page-\d.html'), adding_headers=headers, body='<html></html>')
+    article_generator = _build_article_generator(TEST_CONTENT_DEAD_HOST_DIR, tmpdir, LINKBACKS_CIRCUIT_BREAKER_THRESHOLD=2)
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Host 127.0.0.1 failed 2 consecutive times' in caplog.text
+    assert 'Link url http://localhost/sub/page-3.html skipped because the host of its linkback endpoint failed repeatedly during this run' in caplog.text
+    assert '2 link(s) skipped because their host failed repeatedly, to be retried in a later run' in caplog.text
+    caplog.clear()
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Failed to send WebMention for link url http://localhost/sub/page-1.html' not in caplog.text
+    assert 'Failed to send WebMention for link url http://localhost/sub/page-3.html' in caplog.text
+
+def test_deadline_expired_while_waiting_for_host_slot(monkeypatch):
+    config = LinkbackConfig()
+    @contextmanager
+    def slot(_):
+        config.stop_event.set()  # the deadline expires while this worker waits for its slot
+        yield
+    monkeypatch.setattr(config.host_limiter, 'slot', slot)
+    sources = [(ArticlePlan('article', 'http://localhost/blog/article.html', '42', ['http://localhost/sub/some-page.html']),
+                ['http://localhost/sub/some-page.html'])]
+    assert process_linkback_target('http://localhost/sub/some-page.html', sources, None, config) == (0, False)
+
+def test_deadline_expired_while_notifying_sources(tmpdir, monkeypatch):
+    config = LinkbackConfig({'CACHE_PATH': str(tmpdir)})
+    notified_urls = []
+    def send_webmention(source_url, *_):
+        notified_urls.append(source_url)
+        config.stop_event.set()  # the deadline expires while notifying the first source
+        return True
+    monkeypatch.setattr('linkbacks.linkbacks.send_webmention', send_webmention)
+    sources = [(ArticlePlan(slug, f'http://localhost/blog/{slug}.html', '42', ['http://localhost/sub/some-page.html']),
+                ['http://localhost/sub/some-page.html']) for slug in ('article-1', 'article-2')]
+    endpoints = LinkbackEndpoints(None, 'http://localhost/sub/webmention-endpoint')
+    cache = JsonCache(str(tmpdir.join(CACHE_FILENAME)))
+    assert notify_sources('http://localhost/sub/some-page.html', sources, endpoints, cache, config) == (1, False)
+    assert notified_urls == ['http://localhost/blog/article-1.html']
+    assert not cache.has_link('article-2', 'http://localhost/sub/some-page.html')
+
+@httpretty.activate
+def test_background_insecure_warnings_filter(tmpdir, monkeypatch):
+    _setup_http_mocks()
+    catch_warnings_threads = []
+    class RecordingCatchWarnings(warnings.catch_warnings):
+        def __enter__(self):
+            catch_warnings_threads.append(threading.current_thread())
+            return super().__enter__()
+    monkeypatch.setattr(warnings, 'catch_warnings', RecordingCatchWarnings)
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir, LINKBACKS_BACKGROUND=True, LINKBACKS_CERT_VERIFY=False)
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert join_background_linkbacks() == 2
+    assert catch_warnings_threads and all(thread is threading.main_thread() for thread in catch_warnings_threads)
+    # The filter is removed once the background execution is over:
+    assert not any(category is InsecureRequestWarning for _, _, category, _, _ in warnings.filters)
+
+def test_adaptive_timeouts():
+    host_health = HostHealth(3, adaptive_timeouts=True)
+    assert host_health.timeouts('http://example.com/') == (3, 3)
+    host_health.record_success('http://example.com/some-page', 0.1)
+    host_health.record_success('http://example.com/other-page', 0.5)
+    assert host_health.timeouts('http://example.com/') == (1, 2)
+    host_health.record_success('http://example.com/slow-page', 2)
+    assert host_health.timeouts('http://example.com/') == (1, 3)
+    assert host_health.timeouts('http://other.example.com/') == (3, 3)
+
+def test_is_permanent_failure():
+    def connection_error(errno):
+        error = requests.ConnectionError('Failed to resolve host')
+        error.__cause__ = socket.gaierror(errno, 'Name resolution failure')
+        return error
+    assert is_permanent_failure(connection_error(socket.EAI_NONAME))
+    assert not is_permanent_failure(connection_error(socket.EAI_AGAIN))  # e.g. when offline
+    assert not is_permanent_failure(requests.ConnectionError('Connection refused'))
+
+@httpretty.activate
+def test_link_not_found_given_up(tmpdir, caplog):
+    httpretty.register_uri(httpretty.GET, 'http://localhost/sub/some-page.html', status=404)
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir, LINKBACKS_RETRY_DELAY=0)
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Giving up' not in caplog.text
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Giving up on link url http://localhost/sub/some-page.html after 2 failed attempt(s): [HTTPError]' in caplog.text
+    assert process_all_articles_linkbacks([article_generator]) == 0
+    assert 'Article dummy-article skipped because its content did not change since all its links were processed' in caplog.text
+    assert len(httpretty.latest_requests()) == 2
+
 @httpretty.activate
 def test_pingback_ok_without_http_header(tmpdir):
     _setup_http_mocks(pingback=('link',), webmention=())
@@ -104,6 +531,56 @@ def test_response_too_big_and_link_in_html(tmpdir, caplog):
     assert process_all_articles_linkbacks([article_generator]) == 1
     assert 'The response for URL http://localhost/sub/some-page.html was too large, and hence was truncated' in caplog.text
 
+def test_discover_endpoints_in_html():
+    html = '''<html><head><link rel="pingback" href="/xmlrpc.php"><link rel="stylesheet" href="style.css"></head>
+    <body><a href="https://example.com">Not an endpoint</a><a rel="nofollow webmention" href="webmention-endpoint">Mention me</a></body></html>'''
+    endpoints = discover_endpoints('http://localhost/sub/some-page.html', html, {'Content-Type': 'text/html'})
+    assert endpoints.pingback == 'http://localhost/xmlrpc.php'
+    assert endpoints.webmention == 'http://localhost/sub/webmention-endpoint'
+
+def test_discover_endpoints_headers_take_precedence():
+    headers = {'Content-Type': 'text/html; charset=utf-8', 'X-Pingback': 'http://localhost/pingback',
+               'Link': '<http://localhost/style.css>; rel="stylesheet", <http://localhost/webmention>; rel="webmention"'}
+    html = '<link rel="pingback" href="/other-pingback"><link rel="webmention" href="">'
+    endpoints = discover_endpoints('http://localhost/page.html', html, headers)
+    assert endpoints == ('http://localhost/pingback', 'http://localhost/webmention')
+    del headers['Link']
+    endpoints = discover_endpoints('http://localhost/page.html', html, headers)
+    assert endpoints.webmention == 'http://localhost/page.html'  # an empty href designates the page itself
+
+def test_xmlrpc_transports_are_reused_per_host():
+    config = LinkbackConfig()
+    with config.xmlrpc_transport('http://localhost/xmlrpc.php') as transport:
+        pass
+    with config.xmlrpc_transport('http://localhost/other-endpoint') as same_transport:
+        assert same_transport is transport
+    with config.xmlrpc_transport('https://localhost/xmlrpc.php') as other_transport:
+        assert other_transport is not transport
+    config.close()
+
+@httpretty.activate
+def test_response_too_big_and_discovery_head_only(tmpdir, caplog):
+    _setup_http_mocks(pingback=('link',), webmention=(), fat_html=True)
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir, LINKBACKS_DISCOVERY_HEAD_ONLY=True)
+    assert process_all_articles_linkbacks([article_generator]) == 1
+    assert 'was too large' not in caplog.text
+    assert 'Stopped reading the response for URL http://localhost/sub/some-page.html at the end of its <head>' in caplog.text
+
+@httpretty.activate
+def test_response_too_big_and_all_links_in_headers(tmpdir, caplog):
+    _setup_http_mocks(pingback=('header',), webmention=('header',), fat_html=True)
+    article_generator = _build_article_generator(TEST_CONTENT_DIR, tmpdir)
+    assert process_all_articles_linkbacks([article_generator]) == 2
+    assert 'was too large' not in caplog.text
+
+@httpretty.activate
+def test_response_max_bytes(caplog):
+    httpretty.register_uri(httpretty.GET, 'http://localhost/sub/some-page.html',
+                           adding_headers={'Content-Type': 'text/html; charset=utf-8'}, body='é' * 100)
+    content, _ = requests_get_with_max_size('http://localhost/sub/some-page.html', LinkbackConfig({'LINKBACKS_MAX_RESPONSE_BYTES': 51}))
+    assert content == 'é' * 25 + '\ufffd'
+    assert 'The response for URL http://localhost/sub/some-page.html was too large, and hence was truncated to 51 bytes.' in caplog.text
+
 def _setup_http_mocks(pingback=('header', 'link'), webmention=('header', 'link'), fat_html=False):
     headers = {'Content-Type': 'text/html'}
     if 'header' in pingback:
@@ -165,10 +642,23 @@ def _build_xmlrpc_error(fault_code, fault_string):
         </struct></value>
     </fault></methodResponse>'''
 
-def _build_article_generator(content_path, tmpdir, site_url='http://localhost/blog/'):
+def _xmlrpc_multicall_callback(xmlrpc_calls, supported):
+    def callback(request, _, response_headers):
+        _, method_name = xmlrpc.client.loads(request.body)
+        xmlrpc_calls.append(method_name)
+        if method_name == 'pingback.ping':
+            return 200, response_headers, _build_xmlrpc_success('Pingback registered. Keep the web talking! :-)')
+        if not supported:
+            return 200, response_headers, _build_xmlrpc_error(fault_code=-32601, fault_string='Method not found.')
+        results = [['Pingback registered. Keep the web talking! :-)'], {'faultCode': 48, 'faultString': 'The pingback has already been registered.'}]
+        return 200, response_headers, xmlrpc.client.dumps((results,), methodresponse=True)
+    return callback
+
+def _build_article_generator(content_path, tmpdir, site_url='http://localhost/blog/', **extra_settings):
     settings = get_settings(filenames={})
     _setup_cache_dir(settings['CACHE_PATH'])
     settings['SITEURL'] = site_url
+    settings.update(extra_settings)
     context = settings.copy()
     context['generated_content'] = {}
     context['static_links'] = set()
@@ -181,7 +671,8 @@ def _build_article_generator(content_path, tmpdir, site_url='http://localhost/bl
 def _setup_cache_dir(cache_dir_path):
     if not os.path.isdir(cache_dir_path):
         os.mkdir(cache_dir_path)
-    try:
-        os.remove(os.path.join(cache_dir_path, CACHE_FILENAME))
-    except FileNotFoundError:
-        pass
+    for cache_filename in (CACHE_FILENAME, DISCOVERY_CACHE_FILENAME, METRICS_FILENAME, QUEUE_FILENAME, SQLITE_CACHE_FILENAME):
+        try:
+            os.remove(os.path.join(cache_dir_path, cache_filename))
+        except FileNotFoundError:
+            pass